@@ -1,18 +1,31 @@
+import asyncio
+import json
 import logging
+import os
+import time
 from typing import NamedTuple
 from xml.sax.saxutils import escape
 
 from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion
 
 from config import AIConfig
-from schema import CreateDigestAIRequest, DigestEntry
+from news_accessor import News_Accessor
+from schema import CreateDigestAIRequest, DigestEntry, News
+from summary_cache import CacheStats, SummaryCache
+from tokens import count_tokens
 
 logger = logging.getLogger(__name__)
 
+TOKENS_PER_SENTENCE = 40  # to budget the summaries in a batch response
+TOKENS_PER_SUMMARY_KEY = 10  # the news id, the quotes and the commas around a summary in the JSON response
+OUTPUT_MARGIN = 0.8  # the share of the prompt max_tokens the batch summaries are planned to take
+PROMPTS_DIRECTORY = 'prompt_templates'
+
 
 class NewsEntry(NamedTuple):
     """A simple DTO for news entries."""
 
+    id: int
     url: str
     text: str
     summary: str
@@ -23,11 +36,14 @@ class AI:
     """Class to communicate with the  OpenAI API.
     Provides generate_tags and generate_digest methods."""
 
-    def __init__(self, kernel, config) -> None:
+    def __init__(self, kernel, config, news: News_Accessor, cache: SummaryCache) -> None:
         self._kernel = kernel
         self._config: AIConfig = config
+        self._news = news
+        self._cache = cache
         self._plugin = None
         self._init_kernel()
+        self._batch_output_tokens = int(self._prompt_max_tokens('digest_many') * OUTPUT_MARGIN)
 
     def _init_kernel(self):
         """OpenAI kernel initialization."""
@@ -37,9 +53,17 @@ class AI:
             OpenAIChatCompletion(ai_model_id=self._config.model_id, service_id='chat-gpt')
         )
         self._plugin = self._kernel.add_plugin(
-            parent_directory='prompt_templates', plugin_name='DigestPlugin'
+            parent_directory=PROMPTS_DIRECTORY, plugin_name='DigestPlugin'
         )
 
+    @staticmethod
+    def _prompt_max_tokens(function_name: str) -> int:
+        """Reads the max_tokens of the prompt response from the prompt config."""
+
+        filename = os.path.join(PROMPTS_DIRECTORY, 'DigestPlugin', function_name, 'config.json')
+        with open(filename, 'r') as file:
+            return json.load(file)['execution_settings']['default']['max_tokens']
+
     async def generate_tags(self, description: str, maximum_tags: int) -> str:
         """Generates a list of comma-separated tags from user description."""
 
@@ -49,43 +73,228 @@ class AI:
         """Generates a digest from user description and tags."""
 
         logger.info('Starting digest generation.')
+        if request.news is None:
+            logger.info('The request carries a reference to the news, fetching them')
+            request.news = await self._news.get_new_news(request.news_ref)
         if not request.news.news:
             logger.info('No news for today')
             return []
-        news_by_id = {
-            n.id: NewsEntry(
-                url=n.url, text=n.text, summary=n.summary, title=n.title
-            ) for n in request.news.news
-        }
         interesting_ids = await self._get_most_interesting_ids(request)
         if not interesting_ids:
             logger.info('No interesting news for today')
             return []
-        result = [DigestEntry(
-            url=news_by_id[id_].url,
-            text=str(await self._create_digest(news_by_id[id_].text, request.user.settings.max_sentences))
-        ) for id_ in interesting_ids]
+        news_by_id = await self._get_full_news(request, interesting_ids)
+        result = await self._summarize(
+            [news_by_id[id_] for id_ in interesting_ids if id_ in news_by_id], request.user.settings.max_sentences
+        )
         logger.info('Received digest generation result, proceeding')
         return result
 
+    async def precompute_summaries(self, news: list[News], max_sentences: int) -> int:
+        """Summarizes the news not in the cache yet, so that the digests are served from it.
+        Returns the number of the summaries requested from the AI."""
+
+        entries = [
+            NewsEntry(id=n.id, url=n.url, text=n.text, summary=n.summary, title=n.title) for n in news if n.text
+        ]
+        missing = [
+            entry for entry in entries
+            if await self._cache.get(entry.id, entry.text, max_sentences, record=False) is None
+        ]
+        if missing:
+            await self._summarize(missing, max_sentences, record=False)
+        return len(missing)
+
+    async def _summarize(self, news: list[NewsEntry], max_sentences: int, record: bool = True) -> list[DigestEntry]:
+        """Summarizes the news not cached yet, keeping their order.
+        The news are summarized in batches of about batch_summary_tokens with one request per batch,
+        at most max_concurrent_summaries requests at once. The news a batch failed to summarize are
+        summarized one by one, and a news which fails then too is left out of the digest."""
+
+        semaphore = asyncio.Semaphore(self._config.max_concurrent_summaries)
+        summaries: dict[int, str] = {}
+        missing = []
+        for entry in news:
+            cached = await self._cache.get(entry.id, entry.text, max_sentences, record=record)
+            if cached is None:
+                missing.append(entry)
+            else:
+                summaries[entry.id] = cached
+        batches = self._batches(missing, max_sentences)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self._summarize_batch(batch, max_sentences, semaphore) for batch in batches))
+        wall_time = time.perf_counter() - started
+        calls_time = sum(elapsed for _, elapsed in results)
+        for batch_summaries, _ in results:
+            summaries.update(batch_summaries)
+        digest = [DigestEntry(url=entry.url, text=summaries[entry.id]) for entry in news if entry.id in summaries]
+        logger.info(
+            f'Summarized {len(digest)} out of {len(news)} news, {len(missing)} not cached, in {len(batches)} batches '
+            f'in {wall_time:.1f}s, the calls took {calls_time:.1f}s, '
+            f'{calls_time / wall_time if wall_time else 1:.1f}x speedup'
+        )
+        logger.info(f'Summary cache: {self._cache.stats()}')
+        return digest
+
+    def _batches(self, news: list[NewsEntry], max_sentences: int) -> list[list[NewsEntry]]:
+        """Splits the news in order into batches within the token budget of the input and of the output.
+        The summaries of a batch must fit the max_tokens of the digest_many prompt with a margin,
+        as a truncated JSON response sends every news of the batch to be summarized one by one."""
+
+        batches: list[list[NewsEntry]] = []
+        tokens = output_tokens = 0
+        summary_tokens = max_sentences * TOKENS_PER_SENTENCE + TOKENS_PER_SUMMARY_KEY
+        for entry in news:
+            entry_tokens = count_tokens(entry.text) + summary_tokens
+            if not batches or tokens + entry_tokens > self._config.batch_summary_tokens \
+                    or output_tokens + summary_tokens > self._batch_output_tokens \
+                    or len(batches[-1]) >= self._config.max_batch_news:
+                batches.append([])
+                tokens = output_tokens = 0
+            batches[-1].append(entry)
+            tokens += entry_tokens
+            output_tokens += summary_tokens
+        return batches
+
+    async def _summarize_batch(
+            self, batch: list[NewsEntry], max_sentences: int, semaphore: asyncio.Semaphore
+    ) -> tuple[dict[int, str], float]:
+        """Returns the summaries by news id and the time the calls took."""
+
+        summaries: dict[int, str] = {}
+        elapsed = 0.0
+        if len(batch) > 1:
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    summaries = self._parse_summaries(str(await self._create_digests(batch, max_sentences)), batch)
+                except Exception:
+                    logger.exception(f'Failed to summarize a batch of {len(batch)} news')
+                elapsed += time.perf_counter() - started
+        rest = [entry for entry in batch if entry.id not in summaries]
+        if rest and len(batch) > 1:
+            logger.warning(f'{len(rest)} out of {len(batch)} news of the batch are not summarized, retrying one by one')
+        for entry, (text, entry_elapsed) in zip(
+                rest, await asyncio.gather(*(self._summarize_one(entry, max_sentences, semaphore) for entry in rest))
+        ):
+            elapsed += entry_elapsed
+            if text is not None:
+                summaries[entry.id] = text
+        for entry in batch:
+            if entry.id in summaries:
+                await self._cache.put(entry.id, entry.text, max_sentences, summaries[entry.id])
+        return summaries, elapsed
+
+    async def _summarize_one(
+            self, entry: NewsEntry, max_sentences: int, semaphore: asyncio.Semaphore
+    ) -> tuple[str | None, float]:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                return str(await self._create_digest(entry.text, max_sentences)), time.perf_counter() - started
+            except Exception:
+                logger.exception(f'Failed to summarize {entry.url}')
+                return None, time.perf_counter() - started
+
+    @staticmethod
+    def _parse_summaries(result: str, batch: list[NewsEntry]) -> dict[int, str]:
+        """Returns the summaries of the batch news found in the JSON result, the invalid ones are skipped.
+        Raises ValueError if the result is not a JSON object."""
+
+        result = result.strip().removeprefix('```json').removeprefix('```').removesuffix('```')
+        summaries = json.loads(result)
+        if not isinstance(summaries, dict):
+            raise ValueError(f'Expected a JSON object of summaries, got {type(summaries).__name__}')
+        return {
+            entry.id: summaries[str(entry.id)].strip() for entry in batch
+            if isinstance(summaries.get(str(entry.id)), str) and summaries[str(entry.id)].strip()
+        }
+
+    def cache_stats(self) -> CacheStats:
+        return self._cache.stats()
+
     async def _get_most_interesting_ids(self, request: CreateDigestAIRequest) -> list[int]:
         """Polls the AI to find the ids of most interesting news.
-        Uses user info, tags and news titles and summaries."""
+        Uses user info, tags and news titles and summaries. If they do not fit pick_news_max_tokens,
+        the news are shortlisted shard by shard first, until the shortlist fits."""
 
-        user_description = request.user.settings.info
-        user_tags = request.user.settings.tags
         news = [{'id': n.id, 'summary': escape(n.title + '\n' + '' or n.summary)} for n in request.news.news if n.id and n.title]
-        logger.info('All variables ready, requesting AI help')
+        tokens = count_tokens(str(news))
+        logger.info(f'All variables ready, {len(news)} news of {tokens} tokens, requesting AI help')
+        while tokens > self._config.pick_news_max_tokens:
+            shortlist = await self._shortlist(news, request)
+            if not shortlist:
+                logger.info('No news shortlisted in any shard')
+                return []
+            if len(shortlist) >= len(news):
+                logger.warning('Ranking the shards did not shorten the news, picking from all of them')
+                break
+            news = shortlist
+            tokens = count_tokens(str(news))
+            logger.info(f'Shortlisted {len(news)} news of {tokens} tokens')
+        return await self._pick_news(news, request)
+
+    async def _shortlist(self, news: list[dict], request: CreateDigestAIRequest) -> list[dict]:
+        """The map step of picking from too many news: the news are split into shards of pick_news_shard_tokens,
+        the most interesting ones of every shard are picked concurrently, and the picked news are returned in order.
+        A shard which fails to be ranked is skipped."""
+
+        shards: list[list[dict]] = []
+        tokens = 0
+        for entry in news:
+            entry_tokens = count_tokens(str(entry))
+            if not shards or tokens + entry_tokens > self._config.pick_news_shard_tokens:
+                shards.append([])
+                tokens = 0
+            shards[-1].append(entry)
+            tokens += entry_tokens
+        logger.info(f'Ranking {len(news)} news in {len(shards)} shards')
+        semaphore = asyncio.Semaphore(self._config.max_concurrent_summaries)
+
+        async def rank(shard: list[dict]) -> list[int]:
+            async with semaphore:
+                try:
+                    return await self._pick_news(shard, request)
+                except Exception:
+                    logger.exception(f'Failed to rank a shard of {len(shard)} news')
+                    return []
+
+        picked = {id_ for ids in await asyncio.gather(*(rank(shard) for shard in shards)) for id_ in ids}
+        return [entry for entry in news if entry['id'] in picked]
+
+    async def _pick_news(self, news: list[dict], request: CreateDigestAIRequest) -> list[int]:
         result = await self._kernel.invoke(
             self._plugin['pick_news'],
             news=news,
-            tags=user_tags,
-            desc=user_description,
+            tags=request.user.settings.tags,
+            desc=request.user.settings.info,
             max_news=request.user.settings.max_news
         )
         logger.info(f'Most interestings IDs received: {result}')
         return [int(n.strip()) for n in str(result).split(',')]
 
+    async def _get_full_news(self, request: CreateDigestAIRequest, ids: list[int]) -> dict[int, NewsEntry]:
+        """Returns the picked news with their texts.
+        The request usually carries only the headlines, so the texts are fetched from the news_accessor."""
+
+        news = [n for n in request.news.news if n.id in ids and n.text]
+        found_ids = {n.id for n in news}
+        missing_ids = [id_ for id_ in ids if id_ not in found_ids]
+        if missing_ids:
+            news.extend(await self._news.get_news_by_ids(missing_ids))
+        logger.info(f'Full texts ready for {len(news)} out of {len(ids)} picked news')
+        return {
+            n.id: NewsEntry(id=n.id, url=n.url, text=n.text, summary=n.summary, title=n.title) for n in news
+        }
+
+    async def _create_digests(self, news: list[NewsEntry], amount_of_sentences: int) -> str:
+        """Summarizes several news in one request, the result is a JSON object of the summaries by news id."""
+
+        news_json = json.dumps([{'id': entry.id, 'text': entry.text} for entry in news])
+        return await self._kernel.invoke(
+            self._plugin['digest_many'], news=escape(news_json), amount_of_sentences=amount_of_sentences
+        )
+
     async def _create_digest(self, input: str, amount_of_sentences: int) -> str:
         """Creates a digest from news text and max amount of sentences."""
 
@@ -16,6 +16,7 @@ class GRPCConfig:
     topic: str
     port: int
     pubsub: str
+    news_accessor_app_id: str
 
 
 @dataclass
@@ -26,6 +27,29 @@ class SecretsConfig:
 @dataclass
 class AIConfig:
     model_id: str
+    max_concurrent_summaries: int  # summary requests at once for a digest, bounded by the OpenAI rate limits
+    batch_summary_tokens: int  # the news texts and their summaries summarized in one request
+    max_batch_news: int
+    pick_news_max_tokens: int  # above it the news are ranked in shards first, and then picked from the shortlist
+    pick_news_shard_tokens: int
+
+
+@dataclass
+class SummaryCacheConfig:
+    max_entries: int  # summaries kept in memory
+    ttl_hours: int  # should match the news expiration of the news_accessor
+    redis_host: str  # the tier shared by the replicas, disabled if empty
+    redis_port: int
+    redis_prefix: str
+
+
+@dataclass
+class PrecomputeConfig:
+    max_sentences: list[int]  # the digest lengths to summarize ahead, the users default first
+    min_priority: int  # news matching fewer users tags are summarized only on demand
+    max_per_hour: int  # the budget of the summaries made ahead
+    batch_size: int  # news fetched and summarized at once
+    max_queued: int  # the lowest priority news are dropped above it
 
 
 @dataclass
@@ -34,6 +58,8 @@ class Config:
     grpc: GRPCConfig
     secrets: SecretsConfig
     ai: AIConfig
+    summary_cache: SummaryCacheConfig
+    precompute: PrecomputeConfig
     service_name: str
 
 
@@ -48,9 +74,26 @@ def configure_env_variables(store_name: str):
 def load_config():
     return Config(
         logging=LoggingConfig(logging_config),
-        grpc=GRPCConfig(topic='ai_tasks', port=50053, pubsub='pubsub'),
+        grpc=GRPCConfig(topic='ai_tasks', port=50053, pubsub='pubsub', news_accessor_app_id='news_accessor'),
         secrets=SecretsConfig(store_name='localsecretstore'),
-        ai=AIConfig(model_id='gpt-4o'),
+        ai=AIConfig(
+            model_id='gpt-4o',
+            max_concurrent_summaries=5,
+            batch_summary_tokens=6000,
+            max_batch_news=8,
+            pick_news_max_tokens=30_000,
+            pick_news_shard_tokens=15_000
+        ),
+        summary_cache=SummaryCacheConfig(
+            max_entries=10_000,
+            ttl_hours=24 * 7,
+            redis_host='localhost' if DEBUG else 'redis',
+            redis_port=6379,
+            redis_prefix='SUMMARY:'
+        ),
+        precompute=PrecomputeConfig(
+            max_sentences=[3], min_priority=1, max_per_hour=300, batch_size=10, max_queued=1000
+        ),
         service_name='ai_accessor'
     )
 
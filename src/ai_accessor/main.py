@@ -8,11 +8,16 @@ from cloudevents.sdk.event import v1
 from dapr.clients import DaprClient
 from dapr.clients.exceptions import DaprInternalError
 from dapr.ext.grpc import App, InvokeMethodRequest, InvokeMethodResponse
+from redis.asyncio import Redis
 from semantic_kernel import Kernel
 
 from ai_services import AI
 from config import DEBUG, configure_env_variables, load_config
-from schema import CreateDigestAIRequest, CreateDigestAIResponse, GenerateTagsRequest, GenerateTagsResponse
+from news_accessor import News_Accessor
+from schema import (CreateDigestAIRequest, CreateDigestAIResponse, GenerateTagsRequest, GenerateTagsResponse,
+                    PrecomputeSummariesRequest)
+from summary_cache import SummaryCache
+from summary_worker import SummaryWorker
 
 
 config = load_config()
@@ -49,9 +54,17 @@ async def create_digest(data: CreateDigestAIRequest) -> None:
         client.publish_event(config.grpc.pubsub, config.grpc.topic, response.model_dump_json())
 
 
+async def precompute_summaries(data: PrecomputeSummariesRequest) -> None:
+    """Queues the new news to be summarized ahead of the digests."""
+
+    request = PrecomputeSummariesRequest.model_validate(data)
+    worker.submit(request.news)
+
+
 executors = {
     'generate_tags': generate_tags,
-    'create_digest_ai_request': create_digest
+    'create_digest_ai_request': create_digest,
+    'precompute_summaries': precompute_summaries
 }
 
 
@@ -88,6 +101,15 @@ def ping_service(request: InvokeMethodRequest) -> InvokeMethodResponse:
     return InvokeMethodResponse(data='PONG')
 
 
+@app.method('summary_cache_stats')
+def summary_cache_stats(request: InvokeMethodRequest) -> InvokeMethodResponse:
+    """Returns the hit rate of the summary cache and the tokens it saved."""
+
+    stats = ai.cache_stats()
+    logger.info(f'Summary cache stats: {stats}')
+    return json.dumps(stats._asdict())
+
+
 def run_app():
     """Runs DAPR."""
 
@@ -108,6 +130,7 @@ async def main():
     grpc_thread.start()
     loop_thread = threading.Thread(target=start_event_loop, args=(loop,), daemon=True)
     loop_thread.start()
+    asyncio.run_coroutine_threadsafe(worker.run(), loop)
     await asyncio.Event().wait()
 
 if __name__ == '__main__':
@@ -118,5 +141,14 @@ if __name__ == '__main__':
         except DaprInternalError as e:
             logger.exception(f'Could not connect to the secrets store. Terminating. {str(e)}')
             raise
-    ai = AI(kernel, config.ai)
+    cache_config = config.summary_cache
+    redis = Redis(
+        host=cache_config.redis_host, port=cache_config.redis_port, decode_responses=True, socket_connect_timeout=1
+    ) if cache_config.redis_host else None
+    cache = SummaryCache(
+        cache_config.max_entries, cache_config.ttl_hours * 60 * 60, redis=redis, prefix=cache_config.redis_prefix
+    )
+    news_accessor = News_Accessor(config.grpc.news_accessor_app_id)
+    ai = AI(kernel, config.ai, news_accessor, cache)
+    worker = SummaryWorker(ai, news_accessor, config.precompute)
     asyncio.run(main())
@@ -0,0 +1,53 @@
+import logging
+
+from dapr.aio.clients import DaprClient
+from dapr.clients.exceptions import DaprInternalError
+
+from schema import (NewNewsRequest, NewNewsResponse, News, NewsByIdsRequest,
+                    NewsByIdsResponse)
+
+logger = logging.getLogger(__name__)
+
+
+class News_Accessor:
+    """Provides async interface to fetch the full news from the news_accessor."""
+
+    def __init__(self, app_id: str) -> None:
+        self._app_id = app_id
+
+    async def get_news_by_ids(self, ids: list[int]) -> list[News]:
+        """Fetches full news with given ids, returns an empty list if news_accessor is unavailable."""
+
+        logger.info(f'Fetching {len(ids)} full news')
+        request = NewsByIdsRequest(ids=ids)
+        try:
+            async with DaprClient() as client:
+                response = await client.invoke_method(self._app_id, 'get_news_by_ids', request.model_dump_json())
+        except DaprInternalError as e:
+            logger.exception(f'Could not fetch news: {str(e)}')
+            return []
+        return NewsByIdsResponse.model_validate_json(response.text()).news
+
+    async def get_new_news(self, request: NewNewsRequest) -> NewNewsResponse:
+        """Fetches all the news in the referenced time window page by page,
+        returns no news if news_accessor is unavailable."""
+
+        logger.info(f'Fetching news from {request.from_time} until {request.until}')
+        result = NewNewsResponse(last_news_time=request.until, news=[])
+        try:
+            async with DaprClient() as client:
+                while True:
+                    response = await client.invoke_method(self._app_id, 'get_new_news', request.model_dump_json())
+                    page = NewNewsResponse.model_validate_json(response.text())
+                    result.news.extend(page.news)
+                    if not page.next_cursor:
+                        break
+                    if page.next_cursor == request.cursor:
+                        logger.error(f'The news_accessor returned the same cursor again, stopping: {page.next_cursor}')
+                        break
+                    request = request.model_copy(update={'cursor': page.next_cursor})
+        except DaprInternalError as e:
+            logger.exception(f'Could not fetch news: {str(e)}')
+            return NewNewsResponse(last_news_time=request.until, news=[])
+        logger.info(f'Fetched {len(result.news)} news')
+        return result
@@ -37,20 +37,47 @@ class News(BaseModel):
     title: str
     url: str
     id: int
-    text: str
+    text: str | None = None  # only the headlines are sent to pick the news
     publish_date: str
 
 
+class NewNewsRequest(BaseModel):
+    from_time: str = ''
+    until: str = ''
+    fields: list[str] | None = None
+    cursor: str = ''
+
+
 class NewNewsResponse(BaseModel):
     last_news_time: str
     news: list[News]
+    next_cursor: str = ''
+
+
+class NewsByIdsRequest(BaseModel):
+    ids: list[int]
+
+
+class NewsByIdsResponse(BaseModel):
+    news: list[News]
 
 
 class CreateDigestAIRequest(Message):
     subject: str = 'create_digest_ai_request'
     user: UserResponse
-    news: NewNewsResponse
+    news: NewNewsResponse | None = None
+    news_ref: NewNewsRequest | None = None  # sent instead of the news when they are too big for a message
+    id: int
+
+
+class PrecomputeEntry(BaseModel):
     id: int
+    priority: int  # the users tags the news matches
+
+
+class PrecomputeSummariesRequest(Message):
+    subject: str = 'precompute_summaries'
+    news: list[PrecomputeEntry]
 
 
 class DigestEntry(BaseModel):
@@ -0,0 +1,127 @@
+import logging
+import time
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import NamedTuple
+
+from redis.exceptions import RedisError
+
+from tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+REDIS_RETRY_SECONDS = 60
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    memory_hits: int
+    redis_hits: int
+    misses: int
+    hit_rate: float
+    tokens_saved: int  # estimated prompt and completion tokens of the calls not made
+    entries: int
+
+
+class SummaryCache:
+    """Caches the news summaries, as the users who pick the same news get the same summary.
+    A summary depends only on the news text and the number of sentences, so the key is the news id,
+    the text hash and max_sentences, and an edited text gets a new summary.
+    The summaries are kept in memory, least recently used evicted first, and in Redis if a client is given,
+    to share them between the replicas. Both tiers expire the summaries after ttl_seconds, along with the news.
+    If Redis is unavailable the cache keeps working in memory and tries Redis again a minute later."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int, redis=None, prefix: str = 'SUMMARY:') -> None:
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._redis = redis
+        self._prefix = prefix
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._redis_retry_at = 0.0
+        self._memory_hits = self._redis_hits = self._misses = self._tokens_saved = 0
+
+    @staticmethod
+    def key(news_id: int, text: str, max_sentences: int) -> str:
+        text_hash = blake2b(text.encode(), digest_size=8).hexdigest()
+        return f'{news_id}:{text_hash}:{max_sentences}'
+
+    async def get(self, news_id: int, text: str, max_sentences: int, record: bool = True) -> str | None:
+        """Returns the cached summary, the lookups made not for a digest should not be recorded in the stats."""
+
+        key = self.key(news_id, text, max_sentences)
+        summary = self._get_from_memory(key)
+        tier = 'memory'
+        if summary is None:
+            summary = await self._get_from_redis(key)
+            tier = 'redis'
+            if summary is not None:
+                self._put_to_memory(key, summary)
+        if not record:
+            return summary
+        if summary is None:
+            self._misses += 1
+            return None
+        if tier == 'memory':
+            self._memory_hits += 1
+        else:
+            self._redis_hits += 1
+        self._tokens_saved += count_tokens(text) + count_tokens(summary)
+        return summary
+
+    async def put(self, news_id: int, text: str, max_sentences: int, summary: str) -> None:
+        key = self.key(news_id, text, max_sentences)
+        self._put_to_memory(key, summary)
+        if self._redis_available():
+            try:
+                await self._redis.set(self._prefix + key, summary, ex=self._ttl_seconds)
+            except RedisError as e:
+                self._redis_failed(e)
+
+    def stats(self) -> CacheStats:
+        hits = self._memory_hits + self._redis_hits
+        requests = hits + self._misses
+        return CacheStats(
+            hits=hits,
+            memory_hits=self._memory_hits,
+            redis_hits=self._redis_hits,
+            misses=self._misses,
+            hit_rate=round(hits / requests, 3) if requests else 0.0,
+            tokens_saved=self._tokens_saved,
+            entries=len(self._entries)
+        )
+
+    def _get_from_memory(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, summary = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return summary
+
+    def _put_to_memory(self, key: str, summary: str) -> None:
+        self._entries[key] = (time.monotonic() + self._ttl_seconds, summary)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    async def _get_from_redis(self, key: str) -> str | None:
+        if not self._redis_available():
+            return None
+        try:
+            summary = await self._redis.get(self._prefix + key)
+        except RedisError as e:
+            self._redis_failed(e)
+            return None
+        return summary.decode() if isinstance(summary, bytes) else summary
+
+    def _redis_available(self) -> bool:
+        return self._redis is not None and time.monotonic() >= self._redis_retry_at
+
+    def _redis_failed(self, error: Exception) -> None:
+        if time.monotonic() < self._redis_retry_at:
+            return
+        logger.warning(f'Summary cache Redis is unavailable, using memory only for {REDIS_RETRY_SECONDS}s: {error}')
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
@@ -0,0 +1,87 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+
+from ai_services import AI
+from config import PrecomputeConfig
+from news_accessor import News_Accessor
+from schema import PrecomputeEntry
+
+logger = logging.getLogger(__name__)
+
+SECONDS_IN_HOUR = 60 * 60
+
+
+class SummaryWorker:
+    """Summarizes the newly stored news in the background, so that the digests find the summaries in the cache.
+    The news_accessor announces the new news with the number of the users tags each one matches.
+    The news matching the most tags are summarized first, for every max_sentences value of the config,
+    the news below min_priority are left to be summarized on demand. At most max_per_hour summaries are
+    requested from the AI, and the lowest priority news are dropped when more than max_queued are waiting."""
+
+    def __init__(self, ai: AI, news: News_Accessor, config: PrecomputeConfig) -> None:
+        self._ai = ai
+        self._news = news
+        self._config = config
+        self._queue: list[tuple[int, int]] = []  # (-priority, -id), the newest news first among equals
+        self._queued_ids: set[int] = set()
+        self._requested: deque[float] = deque()  # times of the summaries requested in the last hour
+        self._ready = asyncio.Event()
+
+    def submit(self, entries: list[PrecomputeEntry]) -> None:
+        """Queues the news to be summarized, must be called from the worker event loop."""
+
+        added = 0
+        for entry in entries:
+            if entry.priority < self._config.min_priority or entry.id in self._queued_ids:
+                continue
+            heapq.heappush(self._queue, (-entry.priority, -entry.id))
+            self._queued_ids.add(entry.id)
+            added += 1
+        if len(self._queue) > self._config.max_queued:
+            kept = heapq.nsmallest(self._config.max_queued, self._queue)
+            self._queued_ids = {-id_ for _, id_ in kept}
+            self._queue = kept
+            heapq.heapify(self._queue)
+        logger.info(f'Queued {added} out of {len(entries)} news to summarize, {len(self._queue)} waiting')
+        if self._queue:
+            self._ready.set()
+
+    async def run(self) -> None:
+        """Summarizes the queued news batch by batch, forever."""
+
+        while True:
+            await self._ready.wait()
+            batch = [heapq.heappop(self._queue) for _ in range(min(self._config.batch_size, len(self._queue)))]
+            if not self._queue:
+                self._ready.clear()
+            ids = [-id_ for _, id_ in batch]
+            self._queued_ids.difference_update(ids)
+            try:
+                await self._summarize(ids)
+            except Exception:
+                logger.exception(f'Failed to summarize news {ids} ahead')
+
+    async def _summarize(self, ids: list[int]) -> None:
+        news = await self._news.get_news_by_ids(ids)
+        for max_sentences in self._config.max_sentences:
+            await self._wait_for_budget(len(news))
+            requested = await self._ai.precompute_summaries(news, max_sentences)
+            now = time.monotonic()
+            self._requested.extend(now for _ in range(requested))
+            logger.info(f'Summarized {requested} out of {len(news)} news ahead, {max_sentences} sentences')
+
+    async def _wait_for_budget(self, summaries: int) -> None:
+        """Waits until the summaries fit the hourly budget, counting the ones requested within the last hour."""
+
+        while True:
+            now = time.monotonic()
+            while self._requested and now - self._requested[0] >= SECONDS_IN_HOUR:
+                self._requested.popleft()
+            if len(self._requested) + summaries <= self._config.max_per_hour or not self._requested:
+                return
+            wait = SECONDS_IN_HOUR - (now - self._requested[0])
+            logger.info(f'Summaries budget of the hour is spent, waiting {wait:.0f}s')
+            await asyncio.sleep(wait)
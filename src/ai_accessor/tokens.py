@@ -0,0 +1,7 @@
+CHARS_PER_TOKEN = 4  # the usual estimate for English text with the OpenAI tokenizers
+
+
+def count_tokens(text: str) -> int:
+    """Estimates the tokens of the text by its length, close enough to budget the prompts."""
+
+    return -(-len(text) // CHARS_PER_TOKEN)
@@ -0,0 +1,78 @@
+"""Benchmarks collecting the news of many tag bunches against the local WorldNews API stand-in.
+
+The stand-in (worldnews_stub.py) answers /search-news with synthetic news after a fixed latency,
+so the wall time of an update cycle is mostly the time spent waiting for the API. Compares fetching
+one request at a time with fetching concurrently.
+
+    python bench_fetch.py --bunches 1 4 16 --parallel 1 8 --latency 0.1
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import UTC, datetime, timedelta
+
+from config import NormalizationConfig, ParsingConfig, PollingConfig
+from news_updater import NewsUpdater
+from worldnews_stub import StubSettings, start_stub
+
+
+def parsing_config(host: str, parallel: int, workdir: str = '') -> ParsingConfig:
+    """The config for the stand-in without rate and quota limits, the state files are kept in workdir."""
+
+    workdir = workdir or tempfile.mkdtemp()
+    return ParsingConfig(
+        max_entries=100,
+        news_expiration_hours=timedelta(hours=24 * 7),
+        api_key='stub',
+        max_query_chars=100,
+        default_tags='',
+        near_duplicate_max_distance=6,
+        api_host=host,
+        parallel_requests=parallel,
+        requests_per_second=1000,
+        requests_burst=1000,
+        rate_limited_retries=3,
+        bunch_state_filename=os.path.join(workdir, 'bunch_state.json'),
+        tags_filename=os.path.join(workdir, 'tags.json'),
+        backfill_hours=48,
+        checkpoint_filename=os.path.join(workdir, 'checkpoint.json'),
+        polling=PollingConfig(initial_minutes=0, min_minutes=0, max_minutes=0, target_new_news=1, smoothing=1),
+        max_recent_ids_per_bunch=500,
+        tag_synonyms={},
+        quota_filename=os.path.join(workdir, 'quota.json'),
+        daily_quota_points=10 ** 6,
+        points_per_request=1,
+        points_per_result=0.01,
+        normalization=NormalizationConfig(max_tokens=800, boilerplate_patterns=[r'\bsubscribe\b'])
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bunches', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--parallel', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--latency', type=float, default=0.1, help='stand-in response delay, seconds')
+    parser.add_argument('--available', type=int, default=250, help='news available for every bunch')
+    args = parser.parse_args()
+
+    server, stub, host = start_stub(StubSettings(latency=args.latency, available=args.available))
+    pub_date = (datetime.now(UTC) - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+
+    print(f'{"bunches":>8} {"parallel":>9} {"requests":>9} {"news":>6} {"wall, s":>8}')
+    for bunches in args.bunches:
+        tags_bunches = [f'tag{i}' for i in range(bunches)]
+        for parallel in args.parallel:
+            updater = NewsUpdater(storage=None, config=parsing_config(host, parallel))
+            requests_before = stub.requests
+            start = time.perf_counter()
+            pages = updater._fetch_pages(tags_bunches, dict.fromkeys(tags_bunches, pub_date))
+            news = [news for page in pages for news in page.news]
+            elapsed = time.perf_counter() - start
+            requests = stub.requests - requests_before
+            print(f'{bunches:>8} {parallel:>9} {requests:>9} {len(news):>6} {elapsed:>8.2f}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
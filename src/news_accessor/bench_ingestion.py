@@ -0,0 +1,84 @@
+"""Benchmarks full news update cycles against the local WorldNews API stand-in.
+
+Every run starts with an empty storage in a temporary directory: the first cycle fetches
+the news of all the tags, the next ones poll the same tags again, as the service does. Reports
+the time spent fetching and saving, and the articles ingested per second, to catch regressions offline.
+
+    python bench_ingestion.py --tags 40 --cycles 3 --backend file --latency 0.05
+    python bench_ingestion.py --fixtures fixtures.json --tags 'tesla, nvidia'
+"""
+import argparse
+import logging
+import os
+import tempfile
+from dataclasses import replace
+
+from bench_fetch import parsing_config
+from columnar_storage import ColumnarStorage
+from config import load_storage_config
+from news_updater import NewsUpdater
+from schema import Tags
+from segmented_storage import SegmentedStorage
+from sqlite_storage import SQLiteStorage
+from storage import FileStorage
+from worldnews_stub import StubSettings, start_stub
+
+storages = {
+    'file': FileStorage,
+    'segmented': SegmentedStorage,
+    'sqlite': SQLiteStorage,
+    'columnar': ColumnarStorage
+}
+
+
+def storage_in(workdir: str, backend: str):
+    """Creates the storage with all its files in workdir."""
+
+    config = load_storage_config()
+    paths = {
+        field: os.path.join(workdir, os.path.relpath(getattr(config, field), 'news'))
+        for field in ('latest_update_filename', 'news_filename', 'news_index_filename',
+                      'segments_dir', 'sqlite_filename', 'columns_dir')
+    }
+    os.makedirs(paths['segments_dir'], exist_ok=True)
+    return storages[backend](storage_config=replace(config, backend=backend, **paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tags', default='20', help='number of synthetic tags, or comma separated tags')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--backend', choices=storages, default='file')
+    parser.add_argument('--parallel', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05, help='stand-in response delay, seconds')
+    parser.add_argument('--available', type=int, default=300, help='synthetic news for every tag')
+    parser.add_argument('--fixtures', default='', help='recorded news to serve instead of the synthetic ones')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    tags = ', '.join(f'topic{i}' for i in range(int(args.tags))) if args.tags.isdigit() else args.tags
+    server, stub, host = start_stub(
+        StubSettings(latency=args.latency, available=args.available, fixtures=args.fixtures)
+    )
+    workdir = tempfile.mkdtemp()
+    updater = NewsUpdater(
+        storage=storage_in(workdir, args.backend), config=parsing_config(host, args.parallel, workdir)
+    )
+
+    print(f'{"cycle":>5} {"requests":>9} {"pages":>6} {"news":>6} {"fetch, s":>9} {"save, s":>8} {"news/s":>8}')
+    for cycle in range(1, args.cycles + 1):
+        requests_before = stub.requests
+        report = updater.update_news(Tags(tags=tags))
+        if report is None:
+            print(f'{cycle:>5} nothing due')
+            continue
+        wall = report.fetch_seconds + report.save_seconds
+        print(
+            f'{cycle:>5} {stub.requests - requests_before:>9} {report.pages:>6} {report.news:>6} '
+            f'{report.fetch_seconds:>9.2f} {report.save_seconds:>8.2f} {report.news / wall if wall else 0:>8.0f}'
+        )
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Benchmarks finding the news published after a given time in the FileStorage.
+
+Every size gets a news.json of synthetic news spread evenly over a week, written by the storage
+itself in a temporary directory. A digest usually asks for the latest news, so the cutoff is placed
+near the end of the archive. The cold lookup reads and validates the file, the warm one
+is served from the cache and bisects the time index.
+
+    python bench_lookup.py --sizes 10000 100000 1000000 --repeat 5
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench_ingestion import storage_in
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def generate_news(size: int) -> list[dict]:
+    """Creates synthetic news spread evenly over a week."""
+
+    start = datetime(2024, 8, 1)
+    step = timedelta(days=7) / size
+    return [
+        {
+            'id': i,
+            'title': f'Title {i}',
+            'url': f'https://example.com/news/{i}',
+            'text': f'Text of the news {i}.',
+            'publish_date': (start + step * i).strftime(DATE_FORMAT)
+        }
+        for i in range(size)
+    ]
+
+
+def measure(func, repeat: int) -> float:
+    """Returns the median run time of func in milliseconds."""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tail', type=float, default=0.01, help='share of the news newer than the cutoff')
+    args = parser.parse_args()
+
+    print(f'{"articles":>10} {"returned":>9} {"save ms":>10} {"cold ms":>10} {"warm ms":>10}')
+    for size in args.sizes:
+        news = generate_news(size)
+        cutoff = news[int(size * (1 - args.tail))]['publish_date']
+        with tempfile.TemporaryDirectory() as workdir:
+            storage = storage_in(workdir, 'file')
+            save = measure(lambda: storage.save_news(news, news[-1]['publish_date']), 1)
+
+            def cold_lookup():
+                storage._invalidate_cache()
+                return storage.get_all_news_after_strtime(cutoff)
+
+            returned = len(cold_lookup())
+            assert returned == sum(n['publish_date'] > cutoff for n in news)
+            print(
+                f'{size:>10} {returned:>9} {save:>10.0f} '
+                f'{measure(cold_lookup, args.repeat):>10.1f} '
+                f'{measure(lambda: storage.get_all_news_after_strtime(cutoff), args.repeat):>10.3f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
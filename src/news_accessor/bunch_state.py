@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+from datetime import UTC, datetime, timedelta
+from typing import Callable, Iterable, NamedTuple
+
+from config import PollingConfig
+
+logger = logging.getLogger(__name__)
+
+
+class SeenNews(NamedTuple):
+    """What the state needs to know about a fetched news."""
+
+    id: int
+    publish_date: str
+
+
+class BunchState(NamedTuple):
+    """What has already been fetched for a tag, or a tags bunch: the latest publish date and the newest news ids,
+    and when to poll it next, given how many new news it usually yields."""
+
+    watermark: str
+    recent_ids: list[int]
+    yield_ewma: float = 0.0  # smoothed new news per poll
+    interval_minutes: float = 0.0
+    next_poll: str = ''
+
+
+class BunchStateStore:
+    """Keeps the fetch state of every tag in a JSON file, and derives the state of a tags bunch from its tags,
+    so the states survive the planner packing the tags into other bunches. The tags are keyed by tag_key,
+    the canonical form of the planner. A bunch is searched from the earliest watermark of its tags, knows
+    the recent ids of all of them, and is due as soon as one of them is. A bunch with a tag never polled is new.
+    Every tag is polled on its own schedule: the interval is scaled so that a poll yields about
+    the target amount of new news, so busy tags are polled more often, and the interval
+    of a tag which yielded nothing is doubled. The interval stays within the configured bounds."""
+
+    def __init__(
+            self, filename: str, max_recent_ids: int, polling: PollingConfig,
+            tag_key: Callable[[str], str] = str.lower) -> None:
+        self._filename = filename
+        self._max_recent_ids = max_recent_ids
+        self._polling = polling
+        self._tag_key = tag_key
+        self._states: dict[str, BunchState] = self._load()
+
+    def get(self, bunch: str) -> BunchState | None:
+        """Returns the state of the bunch derived from the states of its tags, None if any of them is new."""
+
+        states = [self._states.get(key) for key in self._keys(bunch)]
+        if not states or None in states:
+            return None
+        recent_ids = list(dict.fromkeys(id_ for state in states for id_ in state.recent_ids))
+        return BunchState(
+            watermark=min(state.watermark for state in states),
+            recent_ids=recent_ids,
+            yield_ewma=sum(state.yield_ewma for state in states),
+            interval_minutes=min(state.interval_minutes for state in states),
+            next_poll=min(state.next_poll for state in states)
+        )
+
+    def is_due(self, bunch: str) -> bool:
+        """Checks if it is time to poll the bunch, the new bunches are always due."""
+
+        state = self.get(bunch)
+        return state is None or state.next_poll <= self._now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def update(self, bunch: str, news: list[SeenNews], watermark: str = '', searched_from: str = '') -> None:
+        """Moves the watermarks of the bunch tags to the latest fetched news, remembers the newest ids
+        and schedules the next polls by the amount of the news not seen before. The news of a bunch
+        are not told apart by tag, so every tag of the bunch gets all of them.
+        The watermark can be given for the news fetched earlier, e.g. before the cycle was interrupted.
+        A tag which has fetched nothing yet keeps the publish date it was searched from,
+        and is not stored without it, as an empty watermark would search from the beginning of time."""
+
+        newest = sorted(news, key=lambda n: (n.publish_date, n.id), reverse=True)
+        for key in self._keys(bunch):
+            state = self._states.get(key, BunchState(watermark='', recent_ids=[]))
+            tag_watermark = max(state.watermark, newest[0].publish_date if newest else '', watermark) or searched_from
+            if not tag_watermark:
+                logger.info(f'{key}: nothing fetched yet, searched as a new tag next time')
+                continue
+            known_ids = set(state.recent_ids)
+            new_ids = [n.id for n in newest if n.id not in known_ids]
+            yield_ewma, interval = self._next_interval(state, len(new_ids))
+            self._states[key] = BunchState(
+                watermark=tag_watermark,
+                recent_ids=(new_ids + state.recent_ids)[:self._max_recent_ids],
+                yield_ewma=yield_ewma,
+                interval_minutes=interval,
+                next_poll=(self._now() + timedelta(minutes=interval)).strftime('%Y-%m-%d %H:%M:%S')
+            )
+            logger.info(f'{key}: {len(new_ids)} new news, next poll in {interval:.0f} minutes')
+
+    def prune(self, tags: Iterable[str]) -> None:
+        """Drops the states of the tags no user has any more."""
+
+        keys = {self._tag_key(tag) for tag in tags}
+        dropped = [key for key in self._states if key not in keys]
+        for key in dropped:
+            del self._states[key]
+        if dropped:
+            logger.info(f'Dropped the state of {len(dropped)} tags no longer searched for')
+
+    def _next_interval(self, state: BunchState, new_news: int) -> tuple[float, float]:
+        """Returns the updated yield average and the interval till the next poll."""
+
+        polling = self._polling
+        if not state.interval_minutes:
+            return float(new_news), polling.initial_minutes
+        yield_ewma = polling.smoothing * new_news + (1 - polling.smoothing) * state.yield_ewma
+        if not new_news:
+            interval = state.interval_minutes * 2
+        else:
+            interval = state.interval_minutes * polling.target_new_news / max(yield_ewma, 1)
+        return yield_ewma, min(max(interval, polling.min_minutes), polling.max_minutes)
+
+    def _now(self) -> datetime:
+        return datetime.now(UTC).replace(tzinfo=None)
+
+    def save(self) -> None:
+        """Replaces the state file atomically."""
+
+        tmp_filename = self._filename + '.tmp'
+        with open(tmp_filename, 'w') as file:
+            json.dump({key: state._asdict() for key, state in self._states.items()}, file)
+        os.replace(tmp_filename, self._filename)
+
+    def _keys(self, bunch: str) -> list[str]:
+        """Returns the keys of the tags of the bunch."""
+
+        return list(dict.fromkeys(self._tag_key(tag) for tag in bunch.split(' OR ') if tag.strip()))
+
+    def _load(self) -> dict[str, BunchState]:
+        """Reads the states, the ones kept by bunch before are given to every tag of the bunch."""
+
+        if not os.path.exists(self._filename):
+            return {}
+        try:
+            with open(self._filename, 'r') as file:
+                stored = {key: BunchState(**state) for key, state in json.load(file).items()}
+        except (json.JSONDecodeError, TypeError):
+            logger.exception('Bunch state file is corrupted, starting from scratch')
+            return {}
+        states: dict[str, BunchState] = {}
+        for bunch, state in stored.items():
+            for key in self._keys(bunch):
+                if key not in states or state.watermark < states[key].watermark:
+                    states[key] = state
+        return states
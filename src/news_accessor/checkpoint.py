@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class BunchProgress(NamedTuple):
+    """The pages of a tags bunch saved in the current cycle."""
+
+    available: int
+    offsets: list[int]
+    watermark: str  # the latest publish date saved for the bunch
+    done: bool
+    oldest: list[str] = []  # the oldest publish date of every saved page, empty for a page without news
+    before: str = ''  # the latest publish date the offsets count from, empty if from the newest news
+
+
+class CycleCheckpoint:
+    """Records the progress of an update cycle in a JSON file after every saved page,
+    so that an interrupted cycle is resumed from where it stopped instead of being started over.
+    The file is removed when the cycle is finished."""
+
+    def __init__(self, filename: str) -> None:
+        self._filename = filename
+        self._cycle: dict | None = self._load()
+
+    def resume(self) -> dict[str, str] | None:
+        """Returns the tags bunches of the interrupted cycle with the publish dates to fetch them from,
+        if there is one."""
+
+        if self._cycle is None:
+            return None
+        return self._cycle['bunches']
+
+    def start(self, bunches: dict[str, str]) -> None:
+        self._cycle = {'bunches': bunches, 'progress': {}}
+        self._save()
+
+    def progress(self, bunch: str) -> BunchProgress:
+        progress = self._cycle['progress'].get(bunch) if self._cycle else None
+        return BunchProgress(**progress) if progress else BunchProgress(0, [], '', False)
+
+    def page_done(self, bunch: str, offset: int | None, available: int, watermark: str, oldest: str = '') -> None:
+        """Records a saved page of the bunch, offset is None if there was no page to fetch."""
+
+        progress = self.progress(bunch)
+        saved = offset is not None
+        self._cycle['progress'][bunch] = progress._replace(
+            available=max(available, progress.available),
+            offsets=progress.offsets + ([offset] if saved else []),
+            oldest=progress.oldest + ([oldest] if saved else []),
+            watermark=max(watermark, progress.watermark)
+        )._asdict()
+        self._save()
+
+    def restart(self, bunch: str, before: str) -> None:
+        """Starts the pages of the bunch over for the news published up to before, keeping its watermark."""
+
+        self._cycle['progress'][bunch] = self.progress(bunch)._replace(
+            available=0, offsets=[], oldest=[], before=before
+        )._asdict()
+        self._save()
+
+    def bunch_done(self, bunch: str) -> None:
+        self._cycle['progress'][bunch] = self.progress(bunch)._replace(done=True)._asdict()
+        self._save()
+
+    def finish(self) -> None:
+        self._cycle = None
+        if os.path.exists(self._filename):
+            os.remove(self._filename)
+
+    def _load(self) -> dict | None:
+        if not os.path.exists(self._filename):
+            return None
+        try:
+            with open(self._filename, 'r') as file:
+                cycle = json.load(file)
+        except json.JSONDecodeError:
+            logger.exception('Checkpoint file is corrupted, starting a new cycle')
+            return None
+        logger.info(f'Found an interrupted update cycle: {list(cycle["bunches"])}')
+        return cycle
+
+    def _save(self) -> None:
+        tmp_filename = self._filename + '.tmp'
+        with open(tmp_filename, 'w') as file:
+            json.dump(self._cycle, file)
+        os.replace(tmp_filename, self._filename)
@@ -0,0 +1,321 @@
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from heapq import merge
+from typing import Iterator, NamedTuple
+
+from schema import News
+from storage import IngestionReport, PageCursor, Storage
+
+logger = logging.getLogger(__name__)
+
+
+class Columns(NamedTuple):
+    """Fixed-width int64 columns, one row per news, sorted by publish time and id."""
+
+    ids: memoryview | array
+    epochs: memoryview | array
+    offsets: memoryview | array
+    lengths: memoryview | array
+
+
+class ColumnarStorage(Storage):
+    """Keeps the news in memory-mapped columns with the article bodies in a separate blob file.
+    A time window is found with a bisect over the publish time column, and only the articles
+    in the window are read and decoded, so the memory used does not depend on how much history is kept.
+    The blob is appended to, and compacted on purge once most of it is taken by expired articles.
+    The files live in a generation directory named by the current file. Appends go to the current generation,
+    while a rewrite creates the next one and switches to it with a single atomic rename of the current file,
+    so the readers, which take no lock, always see a consistent set of files."""
+
+    column_files = Columns(ids='ids.i64', epochs='epochs.i64', offsets='offsets.i64', lengths='lengths.i64')
+    blob_file = 'bodies.bin'
+    current_file = 'CURRENT'
+
+    def __init__(self, storage_config) -> None:
+        super().__init__(storage_config)
+        self._dir = self._config.columns_dir
+        self._write_lock = threading.Lock()
+        self._ids: set[int] | None = None
+        os.makedirs(self._dir, exist_ok=True)
+        if not os.path.exists(os.path.join(self._dir, self.current_file)):
+            self._move_to_first_generation()
+
+    def delete_old_entries(self, news_expiration_hours: timedelta) -> None:
+        """Drops the leading rows published before the cutoff date, compacting the blob if needed."""
+
+        cut_off_date = self._cut_off_date(news_expiration_hours)
+        logger.info(f'Purging news from {cut_off_date}')
+        with self._write_lock:
+            with self._mapped_columns() as columns:
+                expired = bisect_right(columns.epochs, self._epoch_from_dt(cut_off_date))
+                if not expired:
+                    logger.info('Purged 0 old news')
+                    return
+                if self._ids is not None:
+                    self._ids.difference_update(columns.ids[:expired])
+                live = Columns(*(self._to_array(column[expired:]) for column in columns))
+            compacted_blob = None
+            if self._blob_garbage(live) > sum(live.lengths):
+                live, compacted_blob = self._compact_blob(live)
+            self._write_columns(live, compacted_blob)
+        logger.info(f'Purged {expired} old news')
+
+    def save_news(self, final_data, latest_news_date) -> IngestionReport:
+        """Appends the new news bodies to the blob and their rows to the columns."""
+
+        logger.info(f'Saving news columns. {len(final_data)} new entries, {latest_news_date=}')
+        if not final_data:
+            logger.info('No new news, not messing with files')
+            return IngestionReport(new=0, duplicates=0)
+        with self._write_lock:
+            known_ids = self._known_ids()
+            batch = {}
+            for news in final_data:
+                if news['id'] not in known_ids:
+                    batch.setdefault(news['id'], news)
+            rows = sorted(
+                (self._epoch_from_dt(self._dt_from_pd(n['publish_date'])), id_) for id_, n in batch.items()
+            )
+            new = Columns(array('q'), array('q'), array('q'), array('q'))
+            with open(self._path(self.blob_file), 'ab') as blob:
+                offset = blob.tell()
+                for epoch, id_ in rows:
+                    body = json.dumps(batch[id_], default=str).encode()
+                    blob.write(body)
+                    for column, value in zip(new, (id_, epoch, offset, len(body))):
+                        column.append(value)
+                    offset += len(body)
+            self._add_rows(new)
+            known_ids.update(batch)
+        self._save_latest_entry(latest_news_date)
+        logger.info(f'Saved {len(batch)} news, skipped {len(final_data) - len(batch)} already stored')
+        return IngestionReport(new=len(batch), duplicates=len(final_data) - len(batch), new_ids=list(batch))
+
+    def get_all_news_after_strtime(self, strtime: str) -> list[News]:
+        """Public method to get all new news from a specific time in str.
+        Only the rows after the bisected time are read from the blob."""
+
+        dt = self._window_start(strtime)
+        logger.info(f'Fetching all news from {dt}')
+        with self._snapshot() as (columns, blob):
+            total = len(columns.ids)
+            first = bisect_right(columns.epochs, self._epoch_from_dt(dt))
+            result = [
+                News.model_validate_json(bytes(blob[columns.offsets[i]:columns.offsets[i] + columns.lengths[i]]))
+                for i in range(first, total)
+            ]
+        logger.info(f'Returning {len(result)} out of {total} entries.')
+        return result
+
+    def get_news_page(self, cursor: PageCursor, limit: int) -> list[News]:
+        """Returns up to limit news after the cursor, the page start is bisected in the publish time column."""
+
+        after = (self._epoch_from_dt(self._dt_from_pd(cursor.after_date)), cursor.after_id)
+        until = self._epoch_from_dt(self._dt_from_pd(cursor.until))
+        page = []
+        with self._snapshot() as (columns, blob):
+            row = bisect_left(columns.epochs, after[0])
+            while row < len(columns.ids) and (columns.epochs[row], columns.ids[row]) <= after:
+                row += 1
+            for row in range(row, min(row + limit, len(columns.ids))):
+                if columns.epochs[row] > until:
+                    break
+                start = columns.offsets[row]
+                page.append(News.model_validate_json(bytes(blob[start:start + columns.lengths[row]])))
+        return page
+
+    def get_news_by_ids(self, ids: list[int]) -> list[News]:
+        """Returns the stored news with given ids in the order of the ids, unknown ids are skipped.
+        The ids column is scanned, and only the matching articles are decoded."""
+
+        wanted = set(ids)
+        found = {}
+        with self._snapshot() as (columns, blob):
+            for row, id_ in enumerate(columns.ids):
+                if id_ in wanted:
+                    start = columns.offsets[row]
+                    found[id_] = News.model_validate_json(bytes(blob[start:start + columns.lengths[row]]))
+        return [found[id_] for id_ in ids if id_ in found]
+
+    def _add_rows(self, new: Columns) -> None:
+        """Appends the rows if they are newer than the stored ones, otherwise merges them in."""
+
+        if not new.ids:
+            return
+        with self._mapped_columns() as columns:
+            in_order = not columns.ids or (columns.epochs[-1], columns.ids[-1]) <= (new.epochs[0], new.ids[0])
+            if not in_order:
+                logger.info('New news are older than the stored ones, merging the columns')
+                merged = merge(zip(columns.epochs, columns.ids, columns.offsets, columns.lengths),
+                               zip(new.epochs, new.ids, new.offsets, new.lengths))
+                rows = Columns(array('q'), array('q'), array('q'), array('q'))
+                for epoch, id_, offset, length in merged:
+                    for column, value in zip(rows, (id_, epoch, offset, length)):
+                        column.append(value)
+        if in_order:
+            for column, filename in zip(new, self.column_files):
+                with open(self._path(filename), 'ab') as file:
+                    column.tofile(file)
+        else:
+            self._write_columns(rows)
+
+    def _write_columns(self, columns: Columns, compacted_blob: str | None = None) -> None:
+        """Writes the columns into the next generation and switches to it.
+        The blob is hard linked from the current generation, unless a compacted one is given."""
+
+        current = self._generation()
+        generation = current + 1
+        directory = self._generation_dir(generation)
+        shutil.rmtree(directory, ignore_errors=True)  # left by a rewrite which did not finish
+        os.makedirs(directory)
+        for column, filename in zip(columns, self.column_files):
+            with open(os.path.join(directory, filename), 'wb') as file:
+                array('q', column).tofile(file)
+        blob_path = os.path.join(directory, self.blob_file)
+        if compacted_blob:
+            os.replace(compacted_blob, blob_path)
+        elif os.path.exists(self._path(self.blob_file, current)):
+            os.link(self._path(self.blob_file, current), blob_path)
+        self._switch_to(generation)
+
+    def _blob_garbage(self, live: Columns) -> int:
+        """Returns how many blob bytes are taken by articles no row points to."""
+
+        return os.path.getsize(self._path(self.blob_file)) - sum(live.lengths)
+
+    def _compact_blob(self, live: Columns) -> tuple[Columns, str]:
+        """Copies the live articles into a new blob, returns the columns with updated offsets and the blob path."""
+
+        logger.info('Compacting the articles blob')
+        offsets = array('q')
+        tmp_path = os.path.join(self._dir, self.blob_file + '.tmp')
+        with self._mapped(self.blob_file) as blob, open(tmp_path, 'wb') as new_blob:
+            for offset, length in zip(live.offsets, live.lengths):
+                offsets.append(new_blob.tell())
+                new_blob.write(blob[offset:offset + length])
+        return live._replace(offsets=offsets), tmp_path
+
+    def _generation(self) -> int:
+        with open(os.path.join(self._dir, self.current_file), 'r') as file:
+            return int(file.read())
+
+    def _generation_dir(self, generation: int) -> str:
+        return os.path.join(self._dir, f'gen-{generation}')
+
+    def _switch_to(self, generation: int) -> None:
+        """Points the current file to the generation atomically and deletes the generations before the previous one,
+        the previous one is kept for the readers which have just read the current file."""
+
+        tmp_path = os.path.join(self._dir, self.current_file + '.tmp')
+        with open(tmp_path, 'w') as file:
+            file.write(str(generation))
+        os.replace(tmp_path, os.path.join(self._dir, self.current_file))
+        for name in os.listdir(self._dir):
+            if name.startswith('gen-') and int(name.removeprefix('gen-')) < generation - 1:
+                # renamed first, so a reader never finds the generation with some of its files deleted
+                os.replace(os.path.join(self._dir, name), os.path.join(self._dir, f'deleted-{name}'))
+        for name in os.listdir(self._dir):
+            if name.startswith('deleted-'):
+                shutil.rmtree(os.path.join(self._dir, name), ignore_errors=True)
+        logger.info(f'Switched the columns to generation {generation}')
+
+    def _move_to_first_generation(self) -> None:
+        """Moves the files of the flat layout, if any, into the first generation directory."""
+
+        directory = self._generation_dir(0)
+        os.makedirs(directory, exist_ok=True)
+        for filename in (*self.column_files, self.blob_file):
+            if os.path.exists(os.path.join(self._dir, filename)):
+                os.replace(os.path.join(self._dir, filename), os.path.join(directory, filename))
+        self._switch_to(0)
+
+    @contextmanager
+    def _mapped_columns(self, generation: int | None = None) -> Iterator[Columns]:
+        """Maps the columns of the generation, the current one by default, into memory.
+        Columns are appended to one after another, so rows present in all of them are the valid ones."""
+
+        if generation is None:
+            generation = self._generation()
+        with ExitStack() as stack:
+            views = [
+                stack.enter_context(self._mapped(filename, generation)).cast('q') for filename in self.column_files
+            ]
+            rows = min(len(view) for view in views)
+            columns = Columns(*(view[:rows] for view in views))
+            try:
+                yield columns
+            finally:
+                for view in (*columns, *views):
+                    view.release()
+
+    @contextmanager
+    def _snapshot(self) -> Iterator[tuple[Columns, memoryview]]:
+        """Maps the columns and the blob of the current generation for a reader.
+        The mapped files stay readable after a rewrite deletes their generation,
+        and if it is deleted before they are opened, the next generation is mapped instead."""
+
+        while True:
+            generation = self._generation()
+            stack = ExitStack()
+            try:
+                columns = stack.enter_context(self._mapped_columns(generation))
+                blob = stack.enter_context(self._mapped(self.blob_file, generation))
+                break
+            except FileNotFoundError:
+                stack.close()
+                if self._generation() == generation:
+                    raise
+        with stack:
+            yield columns, blob
+
+    @contextmanager
+    def _mapped(self, filename: str, generation: int | None = None) -> Iterator[memoryview]:
+        """Maps a file into memory read-only, an empty or missing file is an empty view.
+        Raises FileNotFoundError if the whole generation is missing."""
+
+        path = self._path(filename, generation)
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            if not os.path.isdir(os.path.dirname(path)):
+                raise
+            yield memoryview(b'')
+            return
+        with file:
+            if not os.fstat(file.fileno()).st_size:
+                yield memoryview(b'')
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def _to_array(self, view: memoryview) -> array:
+        """Copies a mapped column out of the file."""
+
+        result = array('q')
+        result.frombytes(view.tobytes())
+        return result
+
+    def _known_ids(self) -> set[int]:
+        """Returns the stored news ids, the ids column is read only once."""
+
+        if self._ids is None:
+            with self._mapped_columns() as columns:
+                self._ids = set(columns.ids)
+        return self._ids
+
+    def _path(self, filename: str, generation: int | None = None) -> str:
+        """The path of the file in the generation, the current one by default."""
+
+        return os.path.join(self._generation_dir(self._generation() if generation is None else generation), filename)
@@ -14,11 +14,32 @@ class LoggingConfig:
 
 @dataclass
 class StorageConfig:
+    backend: str  # one of the main.storages keys
     latest_update_filename: str
     news_filename: str
+    news_index_filename: str
     latest_update_time_from_now_if_no_file_exists: int
     time_delta_seconds_to_avoid_collisions: int
     hours_of_news_to_return_if_user_has_no_news_read_yet: int
+    segments_dir: str
+    segment_hours: int  # should divide 24
+    sqlite_filename: str
+    columns_dir: str
+
+
+@dataclass
+class PollingConfig:
+    initial_minutes: float
+    min_minutes: float  # should not be less than the news_aggregation_manager pause between updates
+    max_minutes: float
+    target_new_news: int  # new news a poll should yield, the interval is scaled towards it
+    smoothing: float  # weight of the latest poll in the yield average
+
+
+@dataclass
+class NormalizationConfig:
+    max_tokens: int  # the article text is cut to it, keeping the lead paragraphs
+    boilerplate_patterns: list[str]  # regular expressions of the short paragraphs to drop
 
 
 @dataclass
@@ -28,6 +49,32 @@ class ParsingConfig:
     api_key: str
     max_query_chars: int
     default_tags: str
+    near_duplicate_max_distance: int  # max differing SimHash bits of the same story, below 8
+    api_host: str
+    parallel_requests: int  # API requests in flight at once, also the keep-alive connection pool size
+    requests_per_second: float  # the API plan rate limit
+    requests_burst: int
+    rate_limited_retries: int  # retries of a request answered with 429, with exponential backoff
+    bunch_state_filename: str
+    tags_filename: str  # the tags of the previous cycle, to find the new ones
+    backfill_hours: int  # how far back to fetch the news for the new tags, as for the users with no news read yet
+    checkpoint_filename: str
+    polling: PollingConfig
+    max_recent_ids_per_bunch: int  # ids remembered to recognize the already fetched pages
+    tag_synonyms: dict[str, str]  # tag: the canonical tag to search for instead
+    quota_filename: str
+    daily_quota_points: float  # the API plan daily points
+    points_per_request: float  # the cost model, used if the API does not report the cost in the headers
+    points_per_result: float
+    normalization: NormalizationConfig
+
+
+@dataclass
+class FeedsConfig:
+    urls: list[str]  # RSS or Atom feeds polled along with the API on every update
+    state_filename: str
+    parallel: int  # feeds requested at once
+    timeout_seconds: float
 
 
 @dataclass
@@ -35,7 +82,8 @@ class GRPCSettings:
     port: int
     topic: str
     pubsub: str
-    max_news_to_return: int
+    ai_topic: str  # where the new news are announced to be summarized ahead
+    max_news_to_return: int  # the page size of get_new_news
 
 
 @dataclass
@@ -43,6 +91,7 @@ class Config:
     logging: LoggingConfig
     storage: StorageConfig
     parsing: ParsingConfig
+    feeds: FeedsConfig
     grpc: GRPCSettings
     service_name: str
 
@@ -53,26 +102,78 @@ def get_api_key(store_name: str, var: str):
     return result
 
 
+def load_storage_config():
+    return StorageConfig(
+        backend='file',
+        latest_update_filename='news/latest_update.json',
+        news_filename='news/news.json',
+        news_index_filename='news/news.idx',
+        latest_update_time_from_now_if_no_file_exists=24*2,
+        time_delta_seconds_to_avoid_collisions=1,
+        hours_of_news_to_return_if_user_has_no_news_read_yet=48,
+        segments_dir='news/segments',
+        segment_hours=6,
+        sqlite_filename='news/news.db',
+        columns_dir='news/columns'
+    )
+
+
 def load_config():
     news_api_key_var = 'WORLD_NEWS_API_KEY'
     api_key = get_api_key('localsecretstore', news_api_key_var) if not DEBUG else os.getenv(news_api_key_var)
     return Config(
         logging=LoggingConfig(logging_config),
-        storage=StorageConfig(
-            latest_update_filename='news/latest_update.json',
-            news_filename='news/news.json',
-            latest_update_time_from_now_if_no_file_exists=24*2,
-            time_delta_seconds_to_avoid_collisions=1,
-            hours_of_news_to_return_if_user_has_no_news_read_yet=48
-        ),
+        storage=load_storage_config(),
         parsing=ParsingConfig(
             max_entries=100,
             news_expiration_hours=timedelta(hours=24 * 7),
             api_key=api_key,
             max_query_chars=100,
-            default_tags='hi-tech, Biden, Trump, video games, Microsoft, nvidia, IBM, Tesla, celebrities'
+            default_tags='hi-tech, Biden, Trump, video games, Microsoft, nvidia, IBM, Tesla, celebrities',
+            near_duplicate_max_distance=6,
+            api_host='https://api.worldnewsapi.com',
+            parallel_requests=4,
+            requests_per_second=2,
+            requests_burst=2,
+            rate_limited_retries=3,
+            bunch_state_filename='news/bunch_state.json',
+            tags_filename='news/tags.json',
+            backfill_hours=48,
+            checkpoint_filename='news/checkpoint.json',
+            polling=PollingConfig(
+                initial_minutes=60, min_minutes=15, max_minutes=12 * 60, target_new_news=20, smoothing=0.3
+            ),
+            max_recent_ids_per_bunch=500,
+            tag_synonyms={
+                'ai': 'artificial intelligence',
+                'usa': 'united states',
+                'u.s.': 'united states',
+                'uk': 'united kingdom',
+                'gaming': 'video games',
+                'ev': 'electric vehicles'
+            },
+            quota_filename='news/quota.json',
+            daily_quota_points=50,
+            points_per_request=1,
+            points_per_result=0.01,
+            normalization=NormalizationConfig(
+                max_tokens=800,
+                boilerplate_patterns=[
+                    r'\bsubscribe\b', r'\bsign up\b', r'\bnewsletter\b', r'\bread more\b', r'\bclick here\b',
+                    r'\bfollow us\b', r'\bshare this\b', r'^advertisement$', r'all rights reserved', r'\bcookies?\b',
+                    r'^(photo|image|video)( credit)?:', r'\bdownload (our|the) app\b'
+                ]
+            )
+        ),
+        feeds=FeedsConfig(
+            urls=[],
+            state_filename='news/feeds_state.json',
+            parallel=8,
+            timeout_seconds=10
+        ),
+        grpc=GRPCSettings(
+            topic='news_tasks', port=50052, pubsub='pubsub', ai_topic='ai_tasks', max_news_to_return=500
         ),
-        grpc=GRPCSettings(topic='news_tasks', port=50052, pubsub='pubsub', max_news_to_return=500),
         service_name='news_accessor'
     )
 
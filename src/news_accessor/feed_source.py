@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from email.utils import parsedate_to_datetime
+from hashlib import blake2b
+from http import HTTPStatus
+from typing import NamedTuple
+
+from schema import News
+from sources import NewsSource
+
+logger = logging.getLogger(__name__)
+
+
+class FeedState(NamedTuple):
+    """The validators of the last feed response and the ids of the entries already returned."""
+
+    etag: str = ''
+    last_modified: str = ''
+    seen_ids: list[int] = []
+
+
+class FeedSource(NewsSource):
+    """Polls RSS and Atom feeds concurrently and maps their entries to News.
+    Every request is conditional: the ETag and Last-Modified of the previous response are sent back,
+    so an unchanged feed costs a single 304 response. The validators and the ids of the entries
+    already returned are kept per feed in a JSON file, so an entry is returned once.
+    They are kept in memory after a poll, and saved by commit once the storage has saved the entries."""
+
+    name = 'feeds'
+    user_agent = 'news_accessor feed reader'
+
+    def __init__(
+            self, feeds: list[str], state_filename: str, parallel: int, timeout: float,
+            max_age: timedelta, max_seen_ids: int = 500) -> None:
+        self._feeds = feeds
+        self._state_filename = state_filename
+        self._parallel = parallel
+        self._timeout = timeout
+        self._max_age = max_age
+        self._max_seen_ids = max_seen_ids
+        self._states: dict[str, FeedState] = self._load()
+        self._polled: dict[str, FeedState] = {}  # the states of the last poll, till it is committed
+
+    def poll(self) -> list[News]:
+        """Returns the new entries of all the feeds, a feed which fails is skipped till the next poll."""
+
+        self._polled = {}
+        if not self._feeds:
+            return []
+        with ThreadPoolExecutor(max_workers=self._parallel) as executor:
+            results = list(executor.map(self._poll_feed, self._feeds))
+        news = [n for feed_news in results for n in feed_news]
+        logger.info(f'{len(news)} new news from {len(self._feeds)} feeds')
+        return news
+
+    def commit(self) -> None:
+        """Saves the validators and the seen ids of the last poll."""
+
+        if not self._polled:
+            return
+        self._states.update(self._polled)
+        self._polled = {}
+        self._save()
+
+    def _poll_feed(self, url: str) -> list[News]:
+        state = self._states.get(url, FeedState())
+        request = urllib.request.Request(url, headers={'User-Agent': self.user_agent})
+        if state.etag:
+            request.add_header('If-None-Match', state.etag)
+        if state.last_modified:
+            request.add_header('If-Modified-Since', state.last_modified)
+        try:
+            with urllib.request.urlopen(request, timeout=self._timeout) as response:
+                body = response.read()
+                etag, last_modified = response.headers.get('ETag', ''), response.headers.get('Last-Modified', '')
+        except urllib.error.HTTPError as e:
+            if e.code == HTTPStatus.NOT_MODIFIED:
+                logger.info(f'{url} is not modified')
+            else:
+                logger.error(f'Feed {url} error {e.code}')
+            return []
+        except (urllib.error.URLError, TimeoutError) as e:
+            logger.error(f'Feed {url} is unreachable: {e}')
+            return []
+        try:
+            entries = self._parse(body)
+        except ET.ParseError:
+            logger.exception(f'Feed {url} is not valid XML')
+            return []
+        seen_ids = set(state.seen_ids)
+        cut_off = (datetime.now(UTC) - self._max_age).strftime('%Y-%m-%d %H:%M:%S')
+        news = [n for n in entries if n.id not in seen_ids and n.publish_date >= cut_off]
+        self._polled[url] = FeedState(
+            etag=etag,
+            last_modified=last_modified,
+            seen_ids=([n.id for n in news] + state.seen_ids)[:self._max_seen_ids]
+        )
+        logger.info(f'{url}: {len(entries)} entries, {len(news)} new')
+        return news
+
+    def _parse(self, body: bytes) -> list[News]:
+        """Maps the RSS 2.0, RSS 1.0 and Atom entries to News, the entries without a link are skipped."""
+
+        root = ET.fromstring(body)
+        news = []
+        for element in root.iter():
+            if self._local_name(element) not in ('item', 'entry'):
+                continue
+            fields = {}
+            for child in element:
+                fields.setdefault(self._local_name(child), child)
+            url = self._link(element, fields)
+            if not url:
+                continue
+            guid = self._text(fields.get('guid')) or self._text(fields.get('id')) or url
+            text = self._text(fields.get('encoded')) or self._text(fields.get('content'))
+            summary = self._text(fields.get('description')) or self._text(fields.get('summary'))
+            date = next(
+                (self._text(fields[name]) for name in ('pubDate', 'published', 'updated', 'date') if name in fields), ''
+            )
+            news.append(News(
+                id=self._entry_id(guid),
+                title=self._text(fields.get('title')),
+                url=url,
+                text=text or summary,
+                summary=summary or None,
+                publish_date=self._publish_date(date)
+            ))
+        return news
+
+    def _link(self, element: ET.Element, fields: dict[str, ET.Element]) -> str:
+        """Returns the RSS link text, or the href of the Atom alternate link."""
+
+        for child in element:
+            if self._local_name(child) != 'link':
+                continue
+            if child.get('href') and child.get('rel', 'alternate') == 'alternate':
+                return child.get('href')
+        return self._text(fields.get('link'))
+
+    @staticmethod
+    def _entry_id(guid: str) -> int:
+        """A stable id of 63 bits, so that it fits the storages integer ids."""
+
+        return int.from_bytes(blake2b(guid.encode(), digest_size=8).digest(), 'big') >> 1
+
+    @staticmethod
+    def _publish_date(date: str) -> str:
+        """Converts an RFC 822 or ISO 8601 date to the storage format in UTC, the fetch time if there is none."""
+
+        published = None
+        try:
+            published = parsedate_to_datetime(date)
+        except (TypeError, ValueError):
+            try:
+                published = datetime.fromisoformat(date.replace('Z', '+00:00'))
+            except ValueError:
+                pass
+        if published is None:
+            published = datetime.now(UTC)
+        if published.tzinfo is None:
+            published = published.replace(tzinfo=UTC)
+        return published.astimezone(UTC).strftime('%Y-%m-%d %H:%M:%S')
+
+    @staticmethod
+    def _local_name(element: ET.Element) -> str:
+        return element.tag.rsplit('}', 1)[-1] if isinstance(element.tag, str) else ''
+
+    @staticmethod
+    def _text(element: ET.Element | None) -> str:
+        return ''.join(element.itertext()).strip() if element is not None else ''
+
+    def _load(self) -> dict[str, FeedState]:
+        if not os.path.exists(self._state_filename):
+            return {}
+        try:
+            with open(self._state_filename, 'r') as file:
+                return {url: FeedState(**state) for url, state in json.load(file).items()}
+        except (json.JSONDecodeError, TypeError):
+            logger.exception('Feeds state file is corrupted, polling the feeds from scratch')
+            return {}
+
+    def _save(self) -> None:
+        tmp_filename = self._state_filename + '.tmp'
+        with open(tmp_filename, 'w') as file:
+            json.dump({url: state._asdict() for url, state in self._states.items()}, file)
+        os.replace(tmp_filename, self._state_filename)
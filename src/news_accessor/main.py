@@ -3,18 +3,43 @@ import logging
 import logging.config
 
 from cloudevents.sdk.event import v1
+from dapr.clients import DaprClient
+from dapr.clients.exceptions import DaprInternalError
 from dapr.ext.grpc import App, InvokeMethodRequest, InvokeMethodResponse
+from pydantic import ValidationError
 
+from columnar_storage import ColumnarStorage
 from config import load_config
+from feed_source import FeedSource
 from news_updater import NewsUpdater
-from schema import NewNewsResponse, News, UpdateNewsRequest
-from storage import FileStorage
+from schema import (NewNewsRequest, NewNewsResponse, NewsByIdsRequest,
+                    NewsByIdsResponse, PrecomputeEntry,
+                    PrecomputeSummariesRequest, UpdateNewsRequest)
+from segmented_storage import SegmentedStorage
+from sqlite_storage import SQLiteStorage
+from storage import FileStorage, PageCursor
+
+storages = {
+    'file': FileStorage,
+    'segmented': SegmentedStorage,
+    'sqlite': SQLiteStorage,
+    'columnar': ColumnarStorage
+}
 
 config = load_config()
 logging.config.dictConfig(config.logging.settings)
 logger = logging.getLogger(__name__)
-storage = FileStorage(storage_config=config.storage)
-updater = NewsUpdater(storage=storage, config=config.parsing)
+storage = storages[config.storage.backend](storage_config=config.storage)
+sources = []
+if config.feeds.urls:
+    sources.append(FeedSource(
+        config.feeds.urls,
+        state_filename=config.feeds.state_filename,
+        parallel=config.feeds.parallel,
+        timeout=config.feeds.timeout_seconds,
+        max_age=config.parsing.news_expiration_hours
+    ))
+updater = NewsUpdater(storage=storage, config=config.parsing, sources=sources)
 app: App = App()
 
 
@@ -31,11 +56,28 @@ def update_news_subscriber(event: v1.Event):
     logger.info(f'Received news update request {data}')
     request = UpdateNewsRequest.model_validate(data)
     try:
-        updater.update_news(request.detail)
+        report = updater.update_news(request.detail)
     except Exception as e:
         logger.exception(f'Failed to update news: {str(e)}')
     else:
         logger.info('Parse complete')
+        if report and report.new_news:
+            announce_new_news(report.new_news)
+
+
+def announce_new_news(new_news) -> None:
+    """Asks the ai_accessor to summarize the new news ahead of the digests."""
+
+    message = PrecomputeSummariesRequest(
+        news=[PrecomputeEntry(id=news.id, priority=news.priority) for news in new_news]
+    )
+    try:
+        with DaprClient() as client:
+            client.publish_event(config.grpc.pubsub, config.grpc.ai_topic, message.model_dump_json())
+    except DaprInternalError as e:
+        logger.exception(f'Could not announce the new news: {str(e)}')
+    else:
+        logger.info(f'Announced {len(new_news)} new news to be summarized')
 
 
 @app.method('ping')
@@ -46,17 +88,56 @@ def ping_service(request: InvokeMethodRequest) -> InvokeMethodResponse:
     return InvokeMethodResponse(data='PONG')
 
 
+@app.method('get_quota')
+def get_quota(request: InvokeMethodRequest) -> InvokeMethodResponse:
+    """Returns the API points budget left for the day and the forecast."""
+
+    status = updater.quota_status()
+    logger.info(f'Quota status: {status}')
+    return json.dumps(status._asdict())
+
+
 @app.method('get_new_news')
 def get_new_news(request: InvokeMethodRequest) -> InvokeMethodResponse:
-    """Returns all new news that have appeared after the specified time."""
-
-    from_time = request.text()
-    logger.info(f'Preparing new news from {from_time}')
-    news = storage.get_all_news_after_strtime(from_time)
-    result = NewNewsResponse(
-        last_news_time=storage.get_latest_entry_time(),
-        news=[News.model_validate(n) for n in news[-config.grpc.max_news_to_return:]]
-    )
+    """Returns a page of news that have appeared after the specified time, in publish order.
+    Accepts either the time itself or a NewNewsRequest, which can bound the window and limit the fields returned.
+    If there are more news in the window, the response holds the cursor to request the next page with."""
+
+    try:
+        news_request = NewNewsRequest.model_validate_json(request.text())
+    except ValidationError:
+        news_request = NewNewsRequest(from_time=request.text())
+    if news_request.cursor:
+        cursor = PageCursor.decode(news_request.cursor)
+    else:
+        cursor = storage.start_cursor(news_request.from_time, news_request.until)
+    limit = min(news_request.limit or config.grpc.max_news_to_return, config.grpc.max_news_to_return)
+    logger.info(f'Preparing new news after {cursor.after_date}, fields: {news_request.fields or "all"}')
+    news = storage.get_news_page(cursor, limit + 1)
+    next_cursor = ''
+    if len(news) > limit:
+        news = news[:limit]
+        if (news[-1].publish_date, news[-1].id) > (cursor.after_date, cursor.after_id):
+            next_cursor = cursor._replace(after_date=news[-1].publish_date, after_id=news[-1].id).encode()
+        else:
+            logger.error(f'The page does not move past the cursor {cursor}, not returning the next one')
+    result = NewNewsResponse(last_news_time=cursor.until, news=news, next_cursor=next_cursor)
+    logger.info(f'Returning {len(result.news)} entries, more pages: {bool(next_cursor)}')
+    if news_request.fields:
+        fields = set(news_request.fields) | {'id'}
+        return result.model_dump_json(
+            include={'last_news_time': True, 'next_cursor': True, 'news': {'__all__': fields}}
+        )
+    return result.model_dump_json()
+
+
+@app.method('get_news_by_ids')
+def get_news_by_ids(request: InvokeMethodRequest) -> InvokeMethodResponse:
+    """Returns full news with the requested ids."""
+
+    ids = NewsByIdsRequest.model_validate_json(request.text()).ids
+    logger.info(f'Fetching {len(ids)} news by ids')
+    result = NewsByIdsResponse(news=storage.get_news_by_ids(ids))
     logger.info(f'Returning {len(result.news)} entries')
     return result.model_dump_json()
 
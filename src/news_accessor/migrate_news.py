@@ -0,0 +1,46 @@
+"""Imports the news from the JSON file storage into the SQLite storage.
+
+Already imported news are skipped, so it is safe to run the migration again.
+
+    python migrate_news.py --news news/news.json --db news/news.db
+"""
+import argparse
+import json
+import logging
+import os
+from dataclasses import replace
+
+from config import load_storage_config
+from sqlite_storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    defaults = load_storage_config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--news', default=defaults.news_filename, help='news JSON file to import')
+    parser.add_argument('--latest', default=defaults.latest_update_filename, help='latest update JSON file')
+    parser.add_argument('--db', default=defaults.sqlite_filename, help='SQLite database to import to')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    with open(args.news, 'r') as file:
+        news = json.load(file)
+    logger.info(f'Read {len(news)} news from {args.news}')
+    if os.path.exists(args.latest):
+        with open(args.latest, 'r') as file:
+            latest_entry = json.load(file)['latest_entry']
+    else:
+        latest_entry = max((n['publish_date'] for n in news), default=None)
+
+    storage = SQLiteStorage(replace(defaults, sqlite_filename=args.db))
+    if latest_entry is None:
+        logger.info('Nothing to import')
+        return
+    storage.save_news(news, latest_entry)
+    logger.info(f'Imported into {args.db}, latest entry is {latest_entry}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import logging
+import re
+from datetime import datetime
+from hashlib import blake2b
+from typing import Iterable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class Fingerprint(NamedTuple):
+    """SimHash of a news and what is needed to expire it."""
+
+    simhash: int
+    id: int
+    publish_date: str
+
+
+class NearDuplicateDetector:
+    """Finds news telling the same story, e.g. the same agency article reprinted by different outlets.
+    Every news is fingerprinted with a 64-bit SimHash of its title and lead word shingles,
+    the fingerprints are split into bands, so near-identical news share at least one band
+    and only those are compared by Hamming distance.
+    Fingerprints of the stored news are kept to catch the copies arriving in later updates,
+    the ones of a collapsed batch are kept only once the storage has saved its news."""
+
+    bits = 64
+    band_bits = 8
+    shingle_size = 3
+    max_words = 300
+
+    def __init__(self, max_distance: int) -> None:
+        if max_distance >= self.bits // self.band_bits:
+            raise ValueError(f'Banding finds only distances below {self.bits // self.band_bits}')
+        self._max_distance = max_distance
+        self._bands: dict[tuple[int, int], list[Fingerprint]] = {}
+        self._pending: dict[int, Fingerprint] = {}  # the canonical news of the last batch, till they are saved
+        self._seeded = False
+
+    @property
+    def seeded(self) -> bool:
+        return self._seeded
+
+    def seed(self, news: Iterable[dict]) -> None:
+        """Remembers the fingerprints of the already stored news."""
+
+        count = 0
+        for entry in news:
+            self._remember(Fingerprint(self._simhash(entry), entry['id'], entry['publish_date']), self._bands)
+            count += 1
+        self._seeded = True
+        logger.info(f'Near duplicate detector seeded with {count} stored news')
+
+    def collapse(self, news: list[dict]) -> list[dict]:
+        """Keeps one canonical news per cluster of near duplicates.
+        The earliest published news of a cluster is the canonical one, the urls of the others are
+        recorded in its duplicate_urls. Copies of already stored news are dropped without their urls,
+        as the stored news are not rewritten: only the copies within one batch are recorded.
+        The fingerprints of the canonical news are remembered by commit, after the storage saves them."""
+
+        canonical: list[dict] = []
+        by_id: dict[int, dict] = {}
+        batch_bands: dict[tuple[int, int], list[Fingerprint]] = {}
+        self._pending = {}
+        dropped = stored_copies = 0
+        for entry in sorted(news, key=lambda n: n['publish_date']):
+            fingerprint = Fingerprint(self._simhash(entry), entry['id'], entry['publish_date'])
+            original = self._find(fingerprint, self._bands) or self._find(fingerprint, batch_bands)
+            if original is None:
+                self._remember(fingerprint, batch_bands)
+                self._pending[fingerprint.id] = fingerprint
+                entry.setdefault('duplicate_urls', [])
+                by_id[entry['id']] = entry
+                canonical.append(entry)
+                continue
+            dropped += 1
+            if original.id not in by_id:
+                stored_copies += 1
+            elif entry['url'] != by_id[original.id]['url']:
+                by_id[original.id]['duplicate_urls'].append(entry['url'])
+        logger.info(
+            f'Collapsed {dropped} near duplicates, {stored_copies} of them of stored news, {len(canonical)} news left'
+        )
+        return canonical
+
+    def commit(self, ids: Iterable[int]) -> None:
+        """Remembers the fingerprints of the news of the last collapsed batch which the storage has saved."""
+
+        for id_ in ids:
+            fingerprint = self._pending.pop(id_, None)
+            if fingerprint is not None:
+                self._remember(fingerprint, self._bands)
+        self._pending = {}
+
+    def forget_before(self, cut_off_date: datetime) -> None:
+        """Drops the fingerprints of the news that are not stored any more."""
+
+        cut_off = cut_off_date.strftime('%Y-%m-%d %H:%M:%S')
+        for key in list(self._bands):
+            kept = [f for f in self._bands[key] if f.publish_date > cut_off]
+            if kept:
+                self._bands[key] = kept
+            else:
+                del self._bands[key]
+
+    def _find(self, fingerprint: Fingerprint, bands: dict[tuple[int, int], list[Fingerprint]]) -> Fingerprint | None:
+        """Returns a remembered fingerprint close enough to the given one."""
+
+        for key in self._band_keys(fingerprint.simhash):
+            for candidate in bands.get(key, ()):
+                if candidate.id == fingerprint.id:
+                    return candidate
+                if (candidate.simhash ^ fingerprint.simhash).bit_count() <= self._max_distance:
+                    return candidate
+        return None
+
+    def _remember(self, fingerprint: Fingerprint, bands: dict[tuple[int, int], list[Fingerprint]]) -> None:
+        for key in self._band_keys(fingerprint.simhash):
+            bands.setdefault(key, []).append(fingerprint)
+
+    def _band_keys(self, simhash: int) -> list[tuple[int, int]]:
+        mask = (1 << self.band_bits) - 1
+        return [(band, (simhash >> (band * self.band_bits)) & mask) for band in range(self.bits // self.band_bits)]
+
+    def _simhash(self, entry: dict) -> int:
+        """Computes a SimHash over the word shingles of the title and the beginning of the text.
+        The bits of all shingle hashes are counted at once: every hash byte is spread into 16-bit lanes
+        of a big integer, so adding the spread hashes up counts the ones in every bit position."""
+
+        words = re.findall(r'\w+', f"{entry.get('title') or ''} {entry.get('text') or ''}".lower())[:self.max_words]
+        shingles = {
+            ' '.join(words[i:i + self.shingle_size]) for i in range(max(1, len(words) - self.shingle_size + 1))
+        }
+        lanes = 0
+        for shingle in shingles:
+            for position, byte in enumerate(blake2b(shingle.encode(), digest_size=self.bits // 8).digest()):
+                lanes += _SPREAD_BYTE[byte] << (position * 8 * _LANE_BITS)
+        lane_mask = (1 << _LANE_BITS) - 1
+        return sum(
+            1 << bit for bit in range(self.bits) if 2 * (lanes >> (bit * _LANE_BITS) & lane_mask) > len(shingles)
+        )
+
+
+_LANE_BITS = 16  # enough to count the shingles of max_words words
+_SPREAD_BYTE = [sum(1 << (bit * _LANE_BITS) for bit in range(8) if byte >> bit & 1) for byte in range(256)]
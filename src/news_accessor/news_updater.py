@@ -1,120 +1,429 @@
+import json
 import logging
-from typing import Tuple
+import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import UTC, datetime, timedelta
+from http import HTTPStatus
+from typing import Iterable, Iterator, NamedTuple, Tuple
 
 import worldnewsapi
 from worldnewsapi.models.search_news200_response import SearchNews200Response
 from worldnewsapi.rest import ApiException
 
+from bunch_state import BunchState, BunchStateStore, SeenNews
+from checkpoint import BunchProgress, CycleCheckpoint
 from config import ParsingConfig
+from near_duplicates import NearDuplicateDetector
+from normalizer import TextNormalizer
+from query_planner import QueryPlanner
+from quota import QuotaStatus, QuotaTracker
+from rate_limiter import TokenBucket
 from schema import ParseSettings, Tags
+from sources import NewsSource
 
 
 logger = logging.getLogger(__name__)
 
 
+class Page(NamedTuple):
+    """A fetched page of news of a tags bunch, the last one marks that the bunch is complete."""
+
+    bunch: int
+    offset: int | None
+    news: list
+    available: int
+    last: bool
+    deferred: bool = False  # a page of the bunch could not be fetched, the bunch is polled again next time
+
+
+class SummaryCandidate(NamedTuple):
+    """A news stored for the first time, to be summarized ahead of the digests."""
+
+    id: int
+    priority: int  # the users tags it matches
+
+
+class CycleReport(NamedTuple):
+    """What an update cycle fetched and how long it waited for the API and for the storage."""
+
+    bunches: int
+    pages: int
+    news: int
+    fetch_seconds: float
+    save_seconds: float
+    new_news: list[SummaryCandidate] = []
+
+
 class NewsUpdater:
     """A class that provides an interface to the WorldNews API."""
 
-    def __init__(self, storage, config: ParsingConfig) -> None:
+    def __init__(self, storage, config: ParsingConfig, sources: list[NewsSource] | None = None) -> None:
         self._storage = storage
         self._config = config
+        self._sources = sources or []
+        self._interests: set[str] = set()
         self._api_config = None
+        self._api = None
+        self._normalizer = TextNormalizer(
+            self._config.normalization.max_tokens, self._config.normalization.boilerplate_patterns
+        )
+        self._duplicates = NearDuplicateDetector(max_distance=self._config.near_duplicate_max_distance)
+        self._rate_limiter = TokenBucket(rate=self._config.requests_per_second, capacity=self._config.requests_burst)
+        self._quota = QuotaTracker(
+            self._config.quota_filename,
+            daily_budget=self._config.daily_quota_points,
+            request_cost=self._config.points_per_request,
+            result_cost=self._config.points_per_result
+        )
+        self._planner = QueryPlanner(self._config.max_query_chars, synonyms=self._config.tag_synonyms)
+        self._bunch_states = BunchStateStore(
+            self._config.bunch_state_filename,
+            max_recent_ids=self._config.max_recent_ids_per_bunch,
+            polling=self._config.polling,
+            tag_key=self._planner.canonicalize
+        )
+        self._checkpoint = CycleCheckpoint(self._config.checkpoint_filename)
         self._init_api(self._config.api_key)
 
     def _init_api(self, key: str) -> None:
-        """SDK API initialization."""
+        """SDK API initialization.
+        A single client is shared by all the requests, so the connections to the API are kept alive."""
 
         self._api_config = worldnewsapi.Configuration(
-            host='https://api.worldnewsapi.com', ssl_ca_cert=None
+            host=self._config.api_host, ssl_ca_cert=None
         )
         self._api_config.api_key['apiKey'] = key
         self._api_config.api_key['headerApiKey'] = key
+        self._api_config.connection_pool_maxsize = self._config.parallel_requests
+        self._api = worldnewsapi.NewsApi(worldnewsapi.ApiClient(self._api_config))
 
-    def update_news(self, request: Tags):
-        """The public method to update the news given all users tags."""
+    def update_news(self, request: Tags) -> CycleReport | None:
+        """The public method to update the news given all users tags.
+        The news are saved page by page as they arrive, and the progress is checkpointed,
+        so an interrupted cycle is finished first on the next update. The other sources,
+        such as the RSS feeds, are polled on every update, whether any bunch is due or not."""
 
         tags_to_strip = request.tags if request.tags else self._config.default_tags
-        logger.info(f'Preparing to parse news, tags are: {tags_to_strip}')
         tags_list = [tag.strip() for tag in tags_to_strip.split(',')]
-        tags_bunches = self._split_tags(tags_list)
-        all_news = self._collect_news(tags_bunches, self._storage.get_latest_entry_time())
-        self._save_news(all_news)
+        self._interests = {self._planner.canonicalize(tag) for tag in tags_list} - {''}
+        pub_dates = self._checkpoint.resume()
+        if pub_dates:
+            logger.info('Resuming the interrupted update cycle, the new tags will be polled next time')
+        else:
+            logger.info(f'Preparing to parse news, tags are: {tags_to_strip}')
+            pub_dates = self._plan_cycle(tags_list)
+            if not pub_dates:
+                logger.info('No tags bunches are due to be polled yet')
+                if not self._sources:
+                    return None
+            else:
+                self._checkpoint.start(pub_dates)
+        logger.info('Deleting outdated entries')
+        self._storage.delete_old_entries(self._config.news_expiration_hours)
+        self._prepare_near_duplicates()
+        report = CycleReport(bunches=0, pages=0, news=0, fetch_seconds=0.0, save_seconds=0.0)
+        if pub_dates:
+            tags_bunches = list(pub_dates)
+            self._quota.start_cycle()
+            try:
+                report = self._ingest(self._fetch_pages(tags_bunches, pub_dates), pub_dates)
+            finally:
+                self._quota.finish_cycle()
+            self._checkpoint.finish()
+        return report._replace(new_news=report.new_news + self._poll_sources())
 
-    def _fetch_news_page(self, config, api_instance) -> Tuple[list, int]:
-        """Fetches a single response page, or returns an empty list.
-        Re-raises the exception to be caught by higher-level handlers.
-        """
+    def _poll_sources(self) -> list[SummaryCandidate]:
+        """Saves the new news of the other sources, a source which fails does not fail the update.
+        A source commits its poll only after its news are saved, so the news of a failed save come again."""
 
-        try:
-            response: SearchNews200Response = api_instance.search_news(**config)
-            return (response.news, response.available) if response and response.available > 0 else ([], 0)
-        except ApiException:
-            logger.error('Limit reached, nothing to parse :(')
-        return ([], 0)
+        new_news = []
+        for source in self._sources:
+            try:
+                news = source.poll()
+                if news:
+                    new_news.extend(self._save_news(news))
+                source.commit()
+            except Exception:
+                logger.exception(f'Failed to poll {source.name}')
+        return new_news
 
-    def _fetch_all_news_for_bunch(self, config, api_instance) -> list:
-        """Fetches all news for a current bunch of tags"""
+    def _plan_cycle(self, tags_list: list[str]) -> dict[str, str]:
+        """Returns the tags bunches due to be polled with the publish dates to fetch the new ones from.
+        The tags added since the previous cycle are backfilled for backfill_hours,
+        the rest are fetched from the latest entry time, or from their own watermark if polled before."""
 
-        news_list, available_news = self._fetch_news_page(config, api_instance)
-        if not news_list:
-            logger.info('No news in the first page of results, not proceeding.')
-            return []
+        previous_tags = self._read_previous_tags()
+        plan = self._planner.plan(tags_list, previous_tags)
+        self._bunch_states.prune(plan.tags)
+        self._bunch_states.save()
+        incremental = [tags_bunch for tags_bunch in plan.incremental if self._bunch_states.is_due(tags_bunch)]
+        logger.info(
+            f'Planned queries: {plan.incremental}, {len(incremental)} due to be polled, backfilling {plan.backfill}'
+        )
+        if set(plan.tags) != previous_tags:
+            self._save_tags(plan.tags)
+        latest_entry_time = self._storage.get_latest_entry_time()
+        backfill_from = (
+            datetime.now(UTC) - timedelta(hours=self._config.backfill_hours)
+        ).strftime('%Y-%m-%d %H:%M:%S')
+        return {
+            **{tags_bunch: latest_entry_time for tags_bunch in incremental},
+            **{tags_bunch: min(backfill_from, latest_entry_time) for tags_bunch in plan.backfill}
+        }
 
-        total_pages = available_news // config['number']
+    def _read_previous_tags(self) -> set[str] | None:
+        """Returns the canonical tags of the previous cycle, None before the first one."""
 
-        for page in range(1, total_pages + 1):
-            config['offset'] = page * config['number']
-            logger.info(f'Parsing page {page}/{total_pages}')
-            news_page, _ = self._fetch_news_page(config, api_instance)
-            if not news_page:
-                break
-            news_list.extend(news_page)
-        return news_list
+        if not os.path.exists(self._config.tags_filename):
+            return None
+        with open(self._config.tags_filename, 'r') as file:
+            return set(json.load(file))
 
-    def _process_tags_bunch(self, tags_bunch, pub_date) -> list:
-        """Given a tags bunch, tries to download all news for it after given time.
-        Returns a list of news and a boolean indicating if an exception occurred.
-        """
+    def _save_tags(self, tags: list[str]) -> None:
+        with open(self._config.tags_filename, 'w') as file:
+            json.dump(tags, file)
 
-        config = self._prepare_config(pub_date, tags_bunch)
-        with worldnewsapi.ApiClient(self._api_config) as api_client:
-            api_instance = worldnewsapi.NewsApi(api_client)
-            news_list = self._fetch_all_news_for_bunch(config, api_instance)
-            if not news_list:
-                return []
-            return news_list
-
-    def _collect_news(self, tags_bunches, pub_date):
-        """The ultimate news collector.
-        Collects all pages of news gathered for every tag bunch in tag bunches into a single list.
+    def quota_status(self) -> QuotaStatus:
+        """Returns the API points budget of the day, for the updates to be planned with."""
+
+        return self._quota.status()
+
+    def _ingest(self, pages: Iterator[Page], pub_dates: dict[str, str]) -> CycleReport:
+        """Saves the pages one by one, checkpointing every saved page.
+        A storage which rewrites all its news on every save gets the pages of a bunch in one batch
+        when the last one arrives, so a bunch costs a single rewrite.
+        When the last page of a bunch is saved, the bunch state is updated with the news fetched for it,
+        unless a page of the bunch could not be fetched: then the bunch is left due, with its interval as it was."""
+
+        tags_bunches = list(pub_dates)
+        fetched: dict[int, list[SeenNews]] = defaultdict(list)
+        buffered: dict[int, list[Page]] = defaultdict(list)
+        new_news: list[SummaryCandidate] = []
+        total = pages_count = 0
+        save_seconds = 0.0
+        started = time.perf_counter()
+        for page in pages:
+            if self._storage.rewrites_on_save and not page.last:
+                buffered[page.bunch].append(page)
+                continue
+            tags_bunch = tags_bunches[page.bunch]
+            batch = buffered.pop(page.bunch, []) + [page]
+            news_list = [news for batch_page in batch for news in batch_page.news]
+            if news_list:
+                save_started = time.perf_counter()
+                new_news.extend(self._save_news(news_list))
+                save_seconds += time.perf_counter() - save_started
+                fetched[page.bunch].extend(SeenNews(news.id, news.publish_date) for news in news_list)
+                total += len(news_list)
+                pages_count += sum(1 for batch_page in batch if batch_page.news)
+            for batch_page in batch:
+                dates = [news.publish_date for news in batch_page.news]
+                self._checkpoint.page_done(
+                    tags_bunch, batch_page.offset, batch_page.available, max(dates, default=''), min(dates, default='')
+                )
+            if page.last and page.deferred:
+                fetched.pop(page.bunch, None)
+                logger.info(f'{tags_bunch} is left due, some of its pages could not be fetched')
+            elif page.last:
+                progress = self._checkpoint.progress(tags_bunch)
+                self._bunch_states.update(
+                    tags_bunch, fetched.pop(page.bunch, []),
+                    watermark=progress.watermark, searched_from=pub_dates[tags_bunch]
+                )
+                self._bunch_states.save()
+                self._checkpoint.bunch_done(tags_bunch)
+        report = CycleReport(
+            bunches=len(tags_bunches),
+            pages=pages_count,
+            news=total,
+            fetch_seconds=time.perf_counter() - started - save_seconds,
+            save_seconds=save_seconds,
+            new_news=new_news
+        )
+        logger.info(f'Update cycle complete: {report._replace(new_news=len(new_news))}')
+        return report
+
+    def _fetch_news_page(self, config) -> Tuple[list, int] | None:
+        """Fetches a single response page, an empty list if there are no news.
+        Returns None if the page could not be fetched, for the quota is exhausted or the API failed,
+        as that says nothing about the news of the bunch.
+        Waits for the rate limiter before sending the request, retries if the API rate limit is still hit,
+        and records the quota points the request cost.
         """
 
-        all_news = []
-        for tags_bunch in tags_bunches:
-            news_list = self._process_tags_bunch(tags_bunch, pub_date)
-            if not news_list:
-                logger.info('No news found for the current tags bunch, continuing to the next bunch.')
-            all_news.extend(news_list)
-            logger.info(f'News list extended with {len(news_list)} new news')
-        return all_news
-
-    def _save_news(self, news_list):
-        """Saves the news.
+        if self._quota.exhausted():
+            logger.error('Daily API quota is exhausted, not requesting')
+            return None
+        for attempt in range(self._config.rate_limited_retries + 1):
+            self._rate_limiter.acquire()
+            try:
+                api_response = self._api.search_news_with_http_info(**config)
+                break
+            except ApiException as e:
+                if e.status == HTTPStatus.TOO_MANY_REQUESTS and attempt < self._config.rate_limited_retries:
+                    logger.warning(f'API rate limit hit, retrying in {2 ** attempt}s')
+                    time.sleep(2 ** attempt)
+                    continue
+                logger.error(f'API error {e.status}, nothing to parse :(')
+                if e.status == HTTPStatus.PAYMENT_REQUIRED:
+                    self._quota.mark_exhausted()
+                return None
+        response: SearchNews200Response = api_response.data
+        news = response.news if response and response.available > 0 else []
+        self._quota.record(api_response.headers, results=len(news or []))
+        return (news, response.available) if news else ([], 0)
+
+    def _is_known_page(self, news_page: list, state: BunchState) -> bool:
+        """Checks if all the news of the page have been fetched for the bunch before."""
+
+        recent_ids = set(state.recent_ids)
+        return all(news.id in recent_ids or news.publish_date <= state.watermark for news in news_page)
+
+    def _fetch_pages(self, tags_bunches: list[str], pub_dates: dict[str, str]) -> Iterator[Page]:
+        """Fetches the pages of all the bunches, at most parallel_requests at once, and yields them as they arrive,
+        so only the pages being fetched and saved are kept in memory.
+        Every bunch polled before is searched from its own watermark, a new one from its publish date.
+        As soon as the first page tells how many news are available, the rest of the pages are requested:
+        all at once for a new bunch, or one by one until the already fetched news for a known one,
+        as the news come newest first.
+        A bunch of the interrupted cycle is searched again only up to the news it has already saved."""
+
+        # a bunch without a watermark has never fetched anything, so it is searched like a new one
+        states = [self._bunch_states.get(tags_bunch) for tags_bunch in tags_bunches]
+        states = [state if state and state.watermark else None for state in states]
+        configs = [
+            self._prepare_config(state.watermark if state else pub_dates[tags_bunch], tags_bunch)
+            for tags_bunch, state in zip(tags_bunches, states)
+        ]
+        tasks: deque[tuple[int, int]] = deque()
+        pages_left = [0] * len(tags_bunches)
+        deferred = [False] * len(tags_bunches)
+
+        def schedule(i: int, offsets: Iterable[int]) -> None:
+            for offset in offsets:
+                tasks.append((i, offset))
+                pages_left[i] += 1
+
+        for i, tags_bunch in enumerate(tags_bunches):
+            progress = self._checkpoint.progress(tags_bunch)
+            if progress.done:
+                continue
+            if progress.offsets:
+                before = self._resume_before(configs[i]['number'], progress)
+                if before is None:
+                    yield Page(bunch=i, offset=None, news=[], available=progress.available, last=True)
+                    continue
+                self._checkpoint.restart(tags_bunch, before)
+            else:
+                before = progress.before
+            if before:
+                configs[i] = {**configs[i], 'latest_publish_date': before}
+            schedule(i, [0])
+
+        with ThreadPoolExecutor(max_workers=self._config.parallel_requests) as executor:
+            running: dict[Future, tuple[int, int]] = {}
+            while tasks or running:
+                while tasks and len(running) < self._config.parallel_requests:
+                    i, offset = tasks.popleft()
+                    running[executor.submit(self._fetch_news_page, {**configs[i], 'offset': offset})] = (i, offset)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, offset = running.pop(future)
+                    result = future.result()
+                    pages_left[i] -= 1
+                    if result is None:
+                        logger.warning(f'Page {offset} of {tags_bunches[i]} is not fetched, polling it again later')
+                        deferred[i] = True
+                        yield Page(bunch=i, offset=None, news=[], available=0, last=not pages_left[i], deferred=True)
+                        continue
+                    news_page, available_news = result
+                    if not news_page:
+                        logger.info(f'No news for {tags_bunches[i]} at offset {offset}')
+                    else:
+                        schedule(i, self._following_offsets(configs[i], states[i], offset, news_page, available_news))
+                    yield Page(
+                        bunch=i, offset=offset, news=news_page, available=available_news,
+                        last=not pages_left[i], deferred=deferred[i]
+                    )
+
+    def _following_offsets(self, config, state: BunchState | None, offset: int, news_page: list, available_news: int):
+        """Returns the offsets of the pages to fetch after the given one."""
+
+        if state is None:
+            return range(config['number'], available_news, config['number']) if offset == 0 else []
+        if self._is_known_page(news_page, state):
+            logger.info(f'Reached the already fetched news at offset {offset}, stopping')
+            return []
+        return [offset + config['number']] if offset + config['number'] < available_news else []
+
+    def _resume_before(self, number: int, progress: BunchProgress) -> str | None:
+        """Returns the publish date to search the bunch of the interrupted cycle up to, None if all its pages are saved.
+        The news published since would shift the offsets of the saved pages, as the news come newest first,
+        so the search is bounded by the oldest news of the pages saved one after another from the first one.
+        A second of margin keeps the news published in the same second, the ones already stored are dropped on save."""
+
+        oldest = dict(zip(progress.offsets, progress.oldest))
+        offset = 0
+        while offset in oldest:
+            if not oldest[offset]:
+                return None
+            offset += number
+        if offset == 0:
+            return progress.before
+        if offset >= progress.available:
+            return None
+        before = datetime.strptime(oldest[offset - number], '%Y-%m-%d %H:%M:%S') + timedelta(seconds=1)
+        return before.strftime('%Y-%m-%d %H:%M:%S')
+
+    def _save_news(self, news_list) -> list[SummaryCandidate]:
+        """Saves the news and returns the ones not stored before.
         The interface is provided by the injected Storage class, which currently works with the disk,
         but can be changed to work with a db, cloud, or other storage."""
 
-        if not news_list:
-            logger.info('No news collected, not saving.')
-            return
-
-        logger.info(f'Finished collecting new entries, total {len(news_list)} news collected')
         latest_news_date = max(news.publish_date for news in news_list if hasattr(news, 'publish_date'))
-        final_data = [news.model_dump() for news in news_list if hasattr(news, 'model_dump')]
+        final_data = [self._normalize(news.model_dump()) for news in news_list if hasattr(news, 'model_dump')]
+        tokens_before = sum(news['tokens_before'] for news in final_data)
+        tokens_after = sum(news['tokens_after'] for news in final_data)
+        logger.info(f'Texts normalized from {tokens_before} to {tokens_after} tokens')
+        final_data = self._duplicates.collapse(final_data)
+        logger.info(f'Saving {len(final_data)} new news and updating latest news time stamp.')
+        report = self._storage.save_news(final_data, latest_news_date)
+        logger.info(f'Page saved: {report.new} new news, {report.duplicates} duplicates rejected')
+        self._duplicates.commit(report.new_ids)
+        new_ids = set(report.new_ids)
+        return [SummaryCandidate(news['id'], self._priority(news)) for news in final_data if news['id'] in new_ids]
 
-        logger.info('Deleting outdated entries')
-        self._storage.delete_old_entries(self._config.news_expiration_hours)
-        logger.info('Saving new news and updating latest news time stamp.')
-        self._storage.save_news(final_data, latest_news_date)
+    def _priority(self, news: dict) -> int:
+        """The number of the users tags the news mentions, the news matching more interests are summarized first."""
+
+        content = ' '.join(news.get(field) or '' for field in ('title', 'summary', 'text')).lower()
+        return sum(tag in content for tag in self._interests)
+
+    def _normalize(self, news: dict) -> dict:
+        """Replaces the text with its normalized version, the one the prompts get, and records the tokens saved."""
+
+        normalized = self._normalizer.normalize(news.get('text'))
+        news.update(
+            text=normalized.text,
+            summary=self._normalizer.strip(news.get('summary')) or None,
+            title=self._normalizer.strip(news.get('title')),
+            tokens_before=normalized.tokens_before,
+            tokens_after=normalized.tokens_after
+        )
+        return news
+
+    def _prepare_near_duplicates(self) -> None:
+        """Makes the detector remember the stored news from the last news_expiration_hours,
+        loading them from the storage on the first run."""
+
+        cut_off_date = datetime.now(UTC).replace(tzinfo=None) - self._config.news_expiration_hours
+        if not self._duplicates.seeded:
+            stored_news = self._storage.get_all_news_after_strtime(cut_off_date.strftime('%Y-%m-%d %H:%M:%S'))
+            self._duplicates.seed(news.model_dump() for news in stored_news)
+        else:
+            self._duplicates.forget_before(cut_off_date)
 
     def _prepare_config(self, pub_date, bunch) -> dict:
         """Creates a parsing config for the current tags bunch."""
@@ -124,23 +433,3 @@ class NewsUpdater:
         config.update({'earliest_publish_date': pub_date})
         logger.info(f'Config preparation finished: {config}')
         return config
-
-    def _split_tags(self, tags: list[str]) -> list[str]:
-        """Splits the tags into bunches.
-        So that on every request the query parameters does not exceed configured amount of chars."""
-
-        logger.info('Separating tags to bunches')
-        result = []
-        current_bunch = ''
-        separator = ' OR '
-        for tag in tags:
-            tag_with_separator = (separator if current_bunch else '') + tag
-            if len(current_bunch) + len(tag_with_separator) > self._config.max_query_chars:
-                result.append(current_bunch)
-                current_bunch = tag
-            else:
-                current_bunch += tag_with_separator
-        if current_bunch:
-            result.append(current_bunch)
-        logger.info(f'Separated tags ready: {result}')
-        return result
@@ -0,0 +1,121 @@
+import html
+import logging
+import re
+from html.parser import HTMLParser
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4  # the usual estimate for English text with the OpenAI tokenizers
+
+
+class NormalizedText(NamedTuple):
+    text: str
+    tokens_before: int
+    tokens_after: int
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the text of an HTML fragment, the block elements become paragraph breaks."""
+
+    blocks = {'p', 'div', 'br', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'tr', 'section'}
+    skipped = {'script', 'style', 'noscript', 'iframe', 'figure', 'figcaption', 'nav', 'aside', 'footer'}
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skipped:
+            self._skipping += 1
+        elif tag in self.blocks:
+            self.parts.append('\n\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.skipped:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self.blocks:
+            self.parts.append('\n\n')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+class TextNormalizer:
+    """Prepares the article texts for the LLM prompts when the news are saved.
+    Strips the markup, drops the boilerplate paragraphs (subscription offers, share buttons, copyright)
+    and the repeated ones, and cuts the text to max_tokens, keeping the lead paragraphs whole,
+    as the news put the most important first. The tokens are estimated by the text length."""
+
+    separator = '\n\n'
+
+    def __init__(self, max_tokens: int, boilerplate_patterns: list[str]) -> None:
+        self._max_tokens = max_tokens
+        self._boilerplate = re.compile('|'.join(f'(?:{pattern})' for pattern in boilerplate_patterns), re.IGNORECASE)
+
+    def normalize(self, text: str | None) -> NormalizedText:
+        text = text or ''
+        paragraphs = self._drop_boilerplate(self.paragraphs(text))
+        result = self._truncate(paragraphs)
+        return NormalizedText(
+            text=result, tokens_before=self.count_tokens(text), tokens_after=self.count_tokens(result)
+        )
+
+    def strip(self, text: str | None) -> str:
+        """Returns the text without the markup, for the short fields like the summary."""
+
+        return ' '.join(self.paragraphs(text or ''))
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        return -(-len(text) // CHARS_PER_TOKEN)
+
+    @staticmethod
+    def paragraphs(text: str) -> list[str]:
+        """Returns the paragraphs of the text with the markup stripped and the whitespace collapsed."""
+
+        if '<' in text:
+            extractor = _TextExtractor()
+            extractor.feed(text)
+            extractor.close()
+            text = ''.join(extractor.parts)
+        else:
+            text = html.unescape(text)
+        paragraphs = (' '.join(paragraph.split()) for paragraph in re.split(r'\n\s*\n', text))
+        return [paragraph for paragraph in paragraphs if paragraph]
+
+    def _drop_boilerplate(self, paragraphs: list[str]) -> list[str]:
+        seen = set()
+        result = []
+        for paragraph in paragraphs:
+            if paragraph in seen or (len(paragraph) < 200 and self._boilerplate.search(paragraph)):
+                continue
+            seen.add(paragraph)
+            result.append(paragraph)
+        return result
+
+    def _truncate(self, paragraphs: list[str]) -> str:
+        """Keeps the paragraphs in order within the budget, the first one that does not fit
+        is cut at the last sentence end, or at the last word if it is the lead paragraph."""
+
+        left = self._max_tokens * CHARS_PER_TOKEN
+        kept = []
+        for paragraph in paragraphs:
+            if kept:
+                left -= len(self.separator)
+            if left <= 0:
+                break
+            if len(paragraph) <= left:
+                kept.append(paragraph)
+                left -= len(paragraph)
+                continue
+            cut = paragraph[:left]
+            sentence_end = max(cut.rfind('. '), cut.rfind('! '), cut.rfind('? '))
+            if sentence_end > 0:
+                kept.append(cut[:sentence_end + 1])
+            elif not kept:
+                kept.append(cut.rsplit(' ', 1)[0])
+            break
+        return self.separator.join(kept)
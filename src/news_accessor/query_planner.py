@@ -0,0 +1,137 @@
+import logging
+import re
+from collections import Counter, defaultdict
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class QueryPlan(NamedTuple):
+    """The queries for the tags searched before, and separate ones for the tags new since then."""
+
+    tags: list[str]  # the canonical keys of all the tags not covered by others
+    incremental: list[str]
+    backfill: list[str]
+
+
+class QueryPlanner:
+    """Turns the tags of all users into as few API queries as possible.
+    Tags are canonicalized, so 'video  games' and 'video game' become one tag, and synonyms are
+    replaced by their canonical tag. A tag is dropped if another tag covers it: the query for 'tesla'
+    finds all the news about 'tesla stock' too. The rest are packed into ' OR ' queries not longer
+    than max_query_chars, first fit decreasing, which is deterministic for the same set of tags.
+    The canonical form is only the key to merge the tags by, the queries search for the tags
+    as the users wrote them: the most common spelling of every key, so that 'Texas' is not searched as 'texa'."""
+
+    separator = ' OR '
+    # plurals which are names, or singular words, not to be stripped of the s
+    no_singular = {
+        'news', 'series', 'species', 'mars', 'texas', 'hamas', 'james', 'reuters', 'physics', 'economics',
+        'politics', 'olympics', 'lens', 'bus', 'gas', 'paris', 'athens', 'netherlands', 'philippines'
+    }
+
+    def __init__(self, max_query_chars: int, synonyms: dict[str, str]) -> None:
+        self._max_query_chars = max_query_chars
+        self._synonyms = {self._normalize(tag): self._normalize(canonical) for tag, canonical in synonyms.items()}
+
+    def plan(self, tags: list[str], previous_tags: set[str] | None = None) -> QueryPlan:
+        """Returns the queries to search for all the tags with.
+        The tags not in previous_tags are packed into queries of their own, so that they can be backfilled
+        and the queries of the other tags stay the same. Without previous_tags all the tags are incremental."""
+
+        surface_forms = self._surface_forms(tags)
+        canonical = set(surface_forms)
+        uncovered = sorted(self._drop_covered(canonical))
+        new_tags = [tag for tag in uncovered if previous_tags is not None and tag not in previous_tags]
+        plan = QueryPlan(
+            tags=uncovered,
+            incremental=self._pack([surface_forms[tag] for tag in uncovered if tag not in new_tags]),
+            backfill=self._pack([surface_forms[tag] for tag in new_tags])
+        )
+        naive_queries = self.split_in_order(tags)
+        logger.info(
+            f'Planned {len(plan.incremental) + len(plan.backfill)} queries instead of {len(naive_queries)} '
+            f'for {len(tags)} tags: {len(canonical)} canonical, {len(uncovered)} not covered by others, '
+            f'{len(new_tags)} new'
+        )
+        return plan
+
+    def canonicalize(self, tag: str) -> str:
+        """Returns the key of the tag: lowercased, with whitespace collapsed, synonyms resolved
+        and the words singularized, except the names in no_singular, so the case of a tag does not matter."""
+
+        return ' '.join(self._singular(word) for word in self._surface_form(tag).split())
+
+    def _surface_form(self, tag: str) -> str:
+        """The tag to search for: normalized, or its canonical synonym."""
+
+        tag = self._normalize(tag)
+        return self._synonyms.get(tag, tag)
+
+    def _surface_forms(self, tags: list[str]) -> dict[str, str]:
+        """Returns the spelling to search for every canonical key, the most common one, then the shortest."""
+
+        counts: dict[str, Counter] = defaultdict(Counter)
+        for tag in tags:
+            key = self.canonicalize(tag)
+            if key:
+                counts[key][self._surface_form(tag)] += 1
+        return {
+            key: min(forms, key=lambda form: (-forms[form], len(form), form)) for key, forms in counts.items()
+        }
+
+    def split_in_order(self, tags: list[str]) -> list[str]:
+        """Packs the tags as they are, in the given order, the way the queries were built before planning."""
+
+        result = []
+        current_bunch = ''
+        for tag in tags:
+            tag_with_separator = (self.separator if current_bunch else '') + tag
+            if len(current_bunch) + len(tag_with_separator) > self._max_query_chars:
+                result.append(current_bunch)
+                current_bunch = tag
+            else:
+                current_bunch += tag_with_separator
+        if current_bunch:
+            result.append(current_bunch)
+        return result
+
+    def _drop_covered(self, tags: set[str]) -> list[str]:
+        """Leaves only the tags which words do not include all the words of another tag."""
+
+        words = {tag: set(tag.split()) for tag in tags}
+        return [
+            tag for tag in tags
+            if not any(other != tag and words[other] < words[tag] for other in tags)
+        ]
+
+    def _pack(self, tags: list[str]) -> list[str]:
+        """First fit decreasing bin packing, a tag longer than a query gets a query of its own.
+        A tag is packed once, however many times it is given."""
+
+        bunches: list[str] = []
+        for tag in sorted(set(tags), key=lambda t: (-len(t), t)):
+            for i, bunch in enumerate(bunches):
+                if len(bunch) + len(self.separator) + len(tag) <= self._max_query_chars:
+                    bunches[i] = bunch + self.separator + tag
+                    break
+            else:
+                bunches.append(tag)
+        return bunches
+
+    @staticmethod
+    def _normalize(tag: str) -> str:
+        return ' '.join(tag.lower().split())
+
+    def _singular(self, word: str) -> str:
+        """A naive singular form, good enough to merge 'game' and 'games'."""
+
+        if word in self.no_singular:
+            return word
+        if len(word) > 4 and word.endswith('ies'):
+            return word[:-3] + 'y'
+        if len(word) > 4 and re.search(r'(s|x|z|ch|sh)es$', word):
+            return word[:-2]
+        if len(word) > 3 and word.endswith('s') and not re.search(r'(ss|us|is|ws|as)$', word):
+            return word[:-1]
+        return word
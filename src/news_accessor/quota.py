@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import threading
+from datetime import UTC, datetime
+from typing import Mapping, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+SECONDS_IN_DAY = 24 * 60 * 60
+
+
+class QuotaStatus(NamedTuple):
+    """The API points budget of the day and how it is being spent."""
+
+    day: str
+    budget: float
+    used: float
+    left: float
+    allowance: float  # points the spread lets spend right now
+    average_cycle_cost: float
+    forecast: float  # points used by the end of the day at the current pace
+    seconds_until_affordable: int  # until the allowance covers an average cycle, 0 if it does already
+
+
+class QuotaTracker:
+    """Counts the API points spent per UTC day and persists them in a JSON file.
+    The cost of a request is taken from the API quota headers, or estimated with the cost model
+    if there are none. The daily budget is spread evenly over the day: by any time of the day
+    only the part of the budget proportional to the time passed may be spent, plus one cycle ahead,
+    so that the updates do not exhaust the budget in the morning."""
+
+    def __init__(self, filename: str, daily_budget: float, request_cost: float, result_cost: float) -> None:
+        self._filename = filename
+        self._daily_budget = daily_budget
+        self._request_cost = request_cost
+        self._result_cost = result_cost
+        self._lock = threading.Lock()
+        self._state = self._load()
+
+    def record(self, headers: Mapping[str, str] | None, results: int) -> None:
+        """Records the points spent on a request, the quota left reported by the API is trusted over the count.
+        The state is saved right away, so the points spent are not lost if the service stops mid-cycle."""
+
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        with self._lock:
+            self._roll_over()
+            cost = self._header_value(headers, 'x-api-quota-request')
+            if cost is None:
+                cost = self._request_cost + self._result_cost * results
+            self._state['used'] += cost
+            self._state['cycle_cost'] += cost
+            left = self._header_value(headers, 'x-api-quota-left')
+            if left is not None:
+                self._state['left'] = left
+            self._save()
+
+    def exhausted(self) -> bool:
+        """Checks if there are no points left for the day."""
+
+        return self.status().left <= 0
+
+    def mark_exhausted(self) -> None:
+        """Records that the API refused a request for the lack of points."""
+
+        with self._lock:
+            self._roll_over()
+            self._state['left'] = 0.0
+            self._save()
+
+    def start_cycle(self) -> None:
+        with self._lock:
+            self._roll_over()
+            self._state['cycle_cost'] = 0.0
+
+    def finish_cycle(self) -> None:
+        """Updates the average cost of an update cycle and saves the state."""
+
+        with self._lock:
+            cost = self._state['cycle_cost']
+            average = self._state['average_cycle_cost']
+            self._state['average_cycle_cost'] = cost if not average else 0.7 * average + 0.3 * cost
+            logger.info(f'Update cycle cost {cost:.2f} points, average {self._state["average_cycle_cost"]:.2f}')
+            self._save()
+
+    def status(self) -> QuotaStatus:
+        with self._lock:
+            self._roll_over()
+            used, cycle = self._state['used'], self._state['average_cycle_cost']
+            left = self._state['left'] if self._state['left'] is not None else self._daily_budget - used
+            now = self._seconds_since_midnight()
+            day_passed = now / SECONDS_IN_DAY
+            allowance = min(left, self._daily_budget * day_passed + cycle - used)
+            if left <= 0 or left < cycle:
+                wait = SECONDS_IN_DAY - now
+            elif allowance < cycle:
+                wait = used / self._daily_budget * SECONDS_IN_DAY - now
+            else:
+                wait = 0
+            return QuotaStatus(
+                day=self._state['day'],
+                budget=self._daily_budget,
+                used=round(used, 2),
+                left=round(left, 2),
+                allowance=round(allowance, 2),
+                average_cycle_cost=round(cycle, 2),
+                forecast=round(used / day_passed if day_passed else used, 2),
+                seconds_until_affordable=max(0, int(wait))
+            )
+
+    def _header_value(self, headers: dict[str, str], name: str) -> float | None:
+        try:
+            return float(headers[name])
+        except (KeyError, ValueError):
+            return None
+
+    def _roll_over(self) -> None:
+        """Starts counting from zero when a new day begins."""
+
+        today = datetime.now(UTC).strftime('%Y-%m-%d')
+        if self._state['day'] != today:
+            logger.info(f'New quota day, {self._state["used"]:.2f} points were used on {self._state["day"]}')
+            self._state.update(day=today, used=0.0, left=None)
+
+    def _seconds_since_midnight(self) -> float:
+        now = datetime.now(UTC)
+        return (now - now.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
+
+    def _load(self) -> dict:
+        state = {'day': '', 'used': 0.0, 'left': None, 'cycle_cost': 0.0, 'average_cycle_cost': 0.0}
+        if os.path.exists(self._filename):
+            try:
+                with open(self._filename, 'r') as file:
+                    state.update(json.load(file))
+            except json.JSONDecodeError:
+                logger.exception('Quota file is corrupted, counting from scratch')
+        return state
+
+    def _save(self) -> None:
+        tmp_filename = self._filename + '.tmp'
+        with open(tmp_filename, 'w') as file:
+            json.dump(self._state, file)
+        os.replace(tmp_filename, self._filename)
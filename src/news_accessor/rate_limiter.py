@@ -0,0 +1,28 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+    Tokens are added at a constant rate up to the bucket capacity, every request takes one,
+    so short bursts up to the capacity pass at once, and the sustained rate stays within the limit."""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Takes a token, waiting for one to be added if the bucket is empty."""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1
+            # the token is taken right away, so the waiting requests queue up for the next ones
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
@@ -33,8 +33,38 @@ class News(BaseModel):
     id: int
     text: str
     publish_date: str
+    duplicate_urls: list[str] = []  # urls of the same story from other outlets
+    tokens_before: int = 0  # estimated tokens of the text as fetched
+    tokens_after: int = 0  # and after normalization
 
 
 class NewNewsResponse(BaseModel):
     last_news_time: str
     news: list[News]
+    next_cursor: str = ''  # continuation token of the next page, empty on the last one
+
+
+class NewNewsRequest(BaseModel):
+    from_time: str = ''
+    until: str = ''  # the end of the window, up to the latest news if empty
+    cursor: str = ''  # continuation token from the previous page, the window is taken from it
+    limit: int = 0  # page size, capped by max_news_to_return
+    fields: list[str] | None = None  # news fields to return, all if None
+
+
+class NewsByIdsRequest(BaseModel):
+    ids: list[int]
+
+
+class NewsByIdsResponse(BaseModel):
+    news: list[News]
+
+
+class PrecomputeEntry(BaseModel):
+    id: int
+    priority: int  # the users tags the news matches
+
+
+class PrecomputeSummariesRequest(BaseModel):
+    subject: str = 'precompute_summaries'
+    news: list[PrecomputeEntry]
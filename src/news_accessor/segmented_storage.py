@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from schema import News
+from storage import IngestionReport, PageCursor, Storage
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentedStorage(Storage):
+    """Keeps the news in an append-only log of time-bucketed NDJSON segments.
+    Every segment holds the news published within segment_hours, a small manifest
+    lists the segments, so saving costs as much as the new news do, and purging
+    the outdated news is just removing whole segments."""
+
+    manifest_filename = 'manifest.json'
+
+    def __init__(self, storage_config) -> None:
+        super().__init__(storage_config)
+        self._dir = self._config.segments_dir
+        self._manifest_path = os.path.join(self._dir, self.manifest_filename)
+        self._ids_by_segment: dict[str, set[int]] | None = None
+        self._ids: set[int] = set()
+        os.makedirs(self._dir, exist_ok=True)
+
+    def delete_old_entries(self, news_expiration_hours: timedelta) -> None:
+        """Drops the segments which end before the cutoff date."""
+
+        cut_off_date = self._cut_off_date(news_expiration_hours)
+        logger.info(f'Purging segments ending before {cut_off_date}')
+        manifest = self._read_manifest()
+        outdated = [
+            name for name, segment in manifest['segments'].items()
+            if self._dt_from_pd(segment['end']) <= cut_off_date
+        ]
+        purged = 0
+        for name in outdated:
+            purged += manifest['segments'].pop(name)['count']
+            self._remove_segment_file(name)
+            if self._ids_by_segment is not None:
+                self._ids -= self._ids_by_segment.pop(name, set())
+        self._write_manifest(manifest)
+        logger.info(f'Purged {len(outdated)} segments, {purged} old news')
+
+    def save_news(self, final_data, latest_news_date) -> IngestionReport:
+        """Appends the news not seen before to their segments."""
+
+        logger.info(f'Saving news segments. {len(final_data)} new entries, {latest_news_date=}')
+        if not final_data:
+            logger.info('No new news, not messing with files')
+            return IngestionReport(new=0, duplicates=0)
+        manifest = self._read_manifest()
+        known_ids = self._known_ids(manifest)
+        batches: dict[str, list[dict]] = {}
+        for news in final_data:
+            if news['id'] in known_ids:
+                continue
+            known_ids.add(news['id'])
+            batches.setdefault(self._segment_name(news['publish_date']), []).append(news)
+
+        for name, batch in batches.items():
+            self._append_to_segment(name, batch)
+            segment = manifest['segments'].setdefault(name, self._new_segment(name))
+            segment['count'] += len(batch)
+            self._ids_by_segment.setdefault(name, set()).update(news['id'] for news in batch)
+        self._write_manifest(manifest)
+        self._save_latest_entry(latest_news_date)
+        appended = sum(len(batch) for batch in batches.values())
+        logger.info(
+            f'Appended {appended} news to {len(batches)} segments, '
+            f'skipped {len(final_data) - appended} already stored'
+        )
+        return IngestionReport(
+            new=appended,
+            duplicates=len(final_data) - appended,
+            new_ids=[news['id'] for batch in batches.values() for news in batch]
+        )
+
+    def get_all_news_after_strtime(self, strtime: str) -> list[News]:
+        """Public method to get all new news from a specific time in str.
+        Only the segments ending after the requested time are read."""
+
+        dt = self._window_start(strtime)
+        logger.info(f'Fetching all news from {dt}')
+        manifest = self._read_manifest()
+        names = sorted(
+            name for name, segment in manifest['segments'].items() if self._dt_from_pd(segment['end']) > dt
+        )
+        # publish_date is zero-padded, so its string order matches the chronological one
+        after = dt.strftime('%Y-%m-%d %H:%M:%S')
+        result = [news for name in names for news in self._read_segment(name) if news['publish_date'] > after]
+        result.sort(key=lambda x: (x['publish_date'], x['id']))
+        logger.info(f'Returning {len(result)} entries from {len(names)} segments.')
+        return [News.model_validate(n) for n in result]
+
+    def get_news_page(self, cursor: PageCursor, limit: int) -> list[News]:
+        """Returns up to limit news after the cursor, ordered by publish date and id.
+        The segments are read in time order from the one holding the cursor, only until the page is full,
+        and only the news of the page are validated."""
+
+        manifest = self._read_manifest()
+        names = sorted(
+            name for name, segment in manifest['segments'].items()
+            if segment['end'] > cursor.after_date and segment['start'] <= cursor.until
+        )
+        after = (cursor.after_date, cursor.after_id)
+        page = []
+        for name in names:
+            # a segment holds the news published from its start up to its end, so the segments do not overlap
+            page.extend(sorted(
+                (news for news in self._read_segment(name)
+                 if (news['publish_date'], news['id']) > after and news['publish_date'] <= cursor.until),
+                key=lambda x: (x['publish_date'], x['id'])
+            ))
+            if len(page) >= limit:
+                break
+        return [News.model_validate(n) for n in page[:limit]]
+
+    def get_news_by_ids(self, ids: list[int]) -> list[News]:
+        """Returns the stored news with given ids in the order of the ids, unknown ids are skipped.
+        Only the segments holding the ids are read."""
+
+        manifest = self._read_manifest()
+        self._known_ids(manifest)
+        wanted = set(ids)
+        found = {
+            news['id']: news for name, segment_ids in self._ids_by_segment.items() if segment_ids & wanted
+            for news in self._read_segment(name) if news['id'] in wanted
+        }
+        return [News.model_validate(found[id_]) for id_ in ids if id_ in found]
+
+    def _segment_name(self, publish_date: str) -> str:
+        """Returns the name of the segment a news with given publish date belongs to."""
+
+        dt = self._dt_from_pd(publish_date)
+        start = dt.replace(hour=dt.hour - dt.hour % self._config.segment_hours, minute=0, second=0)
+        return start.strftime('%Y%m%dT%H')
+
+    def _new_segment(self, name: str) -> dict:
+        """Creates a manifest entry for a new segment."""
+
+        start = datetime.strptime(name, '%Y%m%dT%H')
+        end = start + timedelta(hours=self._config.segment_hours)
+        return {
+            'file': f'{name}.ndjson',
+            'start': start.strftime('%Y-%m-%d %H:%M:%S'),
+            'end': end.strftime('%Y-%m-%d %H:%M:%S'),
+            'count': 0
+        }
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self._dir, f'{name}.ndjson')
+
+    def _append_to_segment(self, name: str, batch: list[dict]) -> None:
+        """Appends the news to the segment file, one JSON per line.
+        The whole batch goes in a single write to a file opened for appending,
+        so the lock-free readers do not find the lines of a batch split between buffered writes.
+        A line a crash has left without the line end is ended first, not to glue the batch to it."""
+
+        data = ''.join(json.dumps(news, default=str) + '\n' for news in batch).encode()
+        fd = os.open(self._segment_path(name), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b'\n':
+                data = b'\n' + data
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+
+    def _read_segment(self, name: str) -> list[dict]:
+        """Reads all the news from a segment file.
+        A last line without the line end is being written right now, so it is skipped,
+        and so are the lines a crash has left broken."""
+
+        if not os.path.exists(self._segment_path(name)):
+            logger.warning(f'Segment {name} is in the manifest, but not on the disk')
+            return []
+        result = []
+        with open(self._segment_path(name), 'r') as file:
+            for line in file:
+                if not line.endswith('\n') or not line.strip():
+                    continue
+                try:
+                    result.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f'Skipping a broken line in segment {name}')
+        return result
+
+    def _remove_segment_file(self, name: str) -> None:
+        if os.path.exists(self._segment_path(name)):
+            os.remove(self._segment_path(name))
+
+    def _known_ids(self, manifest: dict) -> set[int]:
+        """Returns the ids of all stored news.
+        The segments are scanned only once, after that the ids are kept up to date in memory."""
+
+        if self._ids_by_segment is None:
+            logger.info('Loading stored news ids from segments')
+            self._ids_by_segment = {
+                name: {news['id'] for news in self._read_segment(name)} for name in manifest['segments']
+            }
+            self._ids = set().union(*self._ids_by_segment.values())
+        return self._ids
+
+    def _read_manifest(self) -> dict:
+        """Reads the manifest, or returns an empty one if there's none yet."""
+
+        if not os.path.exists(self._manifest_path):
+            return {'segments': {}}
+        with open(self._manifest_path, 'r') as file:
+            return json.load(file)
+
+    def _write_manifest(self, manifest: dict) -> None:
+        """Replaces the manifest atomically, so that readers never see a half-written one."""
+
+        tmp_path = self._manifest_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(manifest, file, indent=4)
+            file.write('\n')
+        os.replace(tmp_path, self._manifest_path)
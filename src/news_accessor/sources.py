@@ -0,0 +1,19 @@
+from abc import ABC, abstractmethod
+
+from schema import News
+
+
+class NewsSource(ABC):
+    """A source of news besides the WorldNews API search, its news are saved to the same storage.
+    It is polled on every update cycle and should return only the news it has not returned before.
+    What a poll has returned counts as returned once commit is called, after its news are saved,
+    so the news of a poll which failed to be saved are returned again."""
+
+    name: str
+
+    @abstractmethod
+    def poll(self) -> list[News]:
+        pass
+
+    def commit(self) -> None:
+        """Remembers the news of the last poll as returned."""
@@ -0,0 +1,135 @@
+import json
+import logging
+import sqlite3
+import threading
+from datetime import timedelta
+
+from schema import News
+from storage import IngestionReport, PageCursor, Storage
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(Storage):
+    """Keeps the news in a SQLite database in WAL mode,
+    so that readers are not blocked while the news are being updated, and several
+    news_accessor replicas can share the same database file.
+    The news are indexed by id and publish date, the article itself is stored as JSON."""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS news ('
+        'id INTEGER PRIMARY KEY, publish_date TEXT NOT NULL, data TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS news_publish_date ON news (publish_date, id)',
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    )
+    ids_per_query = 500  # the ids bound in one IN query, within the SQLite variables limit
+
+    def __init__(self, storage_config) -> None:
+        super().__init__(storage_config)
+        self._local = threading.local()
+        with self._connection() as connection:
+            for statement in self.schema:
+                connection.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the connection for the current thread, sqlite connections should not be shared."""
+
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._config.sqlite_filename, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def delete_old_entries(self, news_expiration_hours: timedelta) -> None:
+        """Deletes the outdated entries with a range delete over the publish date index."""
+
+        cut_off_date = self._cut_off_date(news_expiration_hours).strftime('%Y-%m-%d %H:%M:%S')
+        logger.info(f'Purging news from {cut_off_date}')
+        with self._connection() as connection:
+            deleted = connection.execute('DELETE FROM news WHERE publish_date <= ?', (cut_off_date,)).rowcount
+        logger.info(f'Purged {deleted} old news')
+
+    def save_news(self, final_data, latest_news_date) -> IngestionReport:
+        """Saves the news, the ones already stored are skipped by the primary key conflict."""
+
+        logger.info(f'Saving news to the db. {len(final_data)} new entries, {latest_news_date=}')
+        if not final_data:
+            logger.info('No new news, not messing with the db')
+            return IngestionReport(new=0, duplicates=0)
+        with self._connection() as connection:
+            known_ids = self._stored_ids(connection, [n['id'] for n in final_data])
+            batch = {}
+            for news in final_data:
+                if news['id'] not in known_ids:
+                    batch.setdefault(news['id'], news)
+            connection.executemany(
+                'INSERT INTO news (id, publish_date, data) VALUES (?, ?, ?) ON CONFLICT (id) DO NOTHING',
+                ((n['id'], n['publish_date'], json.dumps(n, default=str)) for n in batch.values())
+            )
+            self._upsert_latest_entry(connection, latest_news_date)
+        logger.info(f'Saved {len(batch)} news, skipped {len(final_data) - len(batch)} already stored')
+        return IngestionReport(new=len(batch), duplicates=len(final_data) - len(batch), new_ids=list(batch))
+
+    def _stored_ids(self, connection: sqlite3.Connection, ids: list[int]) -> set[int]:
+        """Returns which of the ids are stored, in chunks within the SQLite variables limit."""
+
+        stored = set()
+        for start in range(0, len(ids), self.ids_per_query):
+            chunk = ids[start:start + self.ids_per_query]
+            rows = connection.execute(f'SELECT id FROM news WHERE id IN ({", ".join("?" * len(chunk))})', chunk)
+            stored.update(row[0] for row in rows)
+        return stored
+
+    def get_all_news_after_strtime(self, strtime: str) -> list[News]:
+        """Public method to get all new news from a specific time in str."""
+
+        dt = self._window_start(strtime)
+        logger.info(f'Fetching all news from {dt}')
+        rows = self._connection().execute(
+            'SELECT data FROM news WHERE publish_date > ? ORDER BY publish_date, id',
+            (dt.strftime('%Y-%m-%d %H:%M:%S'),)
+        ).fetchall()
+        logger.info(f'Returning {len(rows)} entries.')
+        return [News.model_validate_json(data) for data, in rows]
+
+    def get_news_page(self, cursor: PageCursor, limit: int) -> list[News]:
+        """Returns up to limit news after the cursor, seeking in the publish date index."""
+
+        rows = self._connection().execute(
+            'SELECT data FROM news WHERE (publish_date, id) > (?, ?) AND publish_date <= ? '
+            'ORDER BY publish_date, id LIMIT ?',
+            (cursor.after_date, cursor.after_id, cursor.until, limit)
+        ).fetchall()
+        return [News.model_validate_json(data) for data, in rows]
+
+    def get_news_by_ids(self, ids: list[int]) -> list[News]:
+        """Returns the stored news with given ids in the order of the ids, unknown ids are skipped.
+        The ids are queried in chunks within the SQLite variables limit."""
+
+        connection = self._connection()
+        found = {}
+        for start in range(0, len(ids), self.ids_per_query):
+            chunk = ids[start:start + self.ids_per_query]
+            found.update(connection.execute(
+                f'SELECT id, data FROM news WHERE id IN ({", ".join("?" * len(chunk))})', chunk
+            ).fetchall())
+        return [News.model_validate_json(found[id_]) for id_ in ids if id_ in found]
+
+    def _read_latest_entry(self) -> str | None:
+        """The latest entry lives in the db, so that all replicas see the same one."""
+
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'latest_entry'").fetchone()
+        return row[0] if row else None
+
+    def _save_latest_entry(self, latest_news_date) -> None:
+        with self._connection() as connection:
+            self._upsert_latest_entry(connection, latest_news_date)
+
+    def _upsert_latest_entry(self, connection: sqlite3.Connection, latest_news_date) -> None:
+        connection.execute(
+            "INSERT INTO meta (key, value) VALUES ('latest_entry', ?) "
+            'ON CONFLICT (key) DO UPDATE SET value = max(value, excluded.value)',
+            (str(latest_news_date),)
+        )
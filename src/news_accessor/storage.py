@@ -1,50 +1,215 @@
+import base64
 import json
 import logging
 import os
+import threading
 from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
+from calendar import timegm
 from datetime import UTC, datetime, timedelta
+from heapq import merge
+from operator import itemgetter
+from typing import Any, NamedTuple
 
 from config import StorageConfig
+from schema import News
 
 logger = logging.getLogger(__name__)
+MAX_ID = 2 ** 63 - 1  # news ids are int64, a cursor with it starts after all the news of its second
+
+
+class CacheEntry(NamedTuple):
+    """A value read from a file and the file stamp (mtime and size) it was read at."""
+
+    stamp: tuple[int, int]
+    value: Any
+
+
+class IngestionReport(NamedTuple):
+    """How many of the saved news were new, and how many had already been stored."""
+
+    new: int
+    duplicates: int
+    new_ids: list[int] = []
+
+
+class PageCursor(NamedTuple):
+    """Where the next page of a time window starts: after the news with the given publish date and id.
+    The end of the window is fixed when the first page is requested, so that the news saved
+    while the pages are being read do not shift it."""
+
+    until: str
+    after_date: str
+    after_id: int
+
+    def encode(self) -> str:
+        """Returns an opaque continuation token."""
+
+        return base64.urlsafe_b64encode(json.dumps(self).encode()).decode()
+
+    @classmethod
+    def decode(cls, token: str) -> 'PageCursor':
+        """Reads the cursor from a continuation token, raises ValueError if the token is malformed."""
+
+        try:
+            return cls(*json.loads(base64.urlsafe_b64decode(token)))
+        except (TypeError, json.JSONDecodeError) as e:
+            raise ValueError(f'Malformed cursor: {token}') from e
 
 
 class Storage(ABC):
     """And abstract class, its child will be injected into a news updater class.
     It will take care of storage - related operations."""
 
+    rewrites_on_save = False  # every save rewrites all the stored news, so the updater saves them in bigger batches
+
+    def __init__(self, storage_config: StorageConfig):
+        self._config = storage_config
+
     @abstractmethod
     def delete_old_entries(self, news_expiration_hours: timedelta):
         pass
 
     @abstractmethod
-    def save_news(self, final_data, latest_news_date):
+    def save_news(self, final_data, latest_news_date) -> IngestionReport:
         pass
 
     @abstractmethod
-    def get_latest_entry_time(self, format: str = ''):
+    def get_all_news_after_strtime(self, strtime: str) -> list[News]:
         pass
 
     @abstractmethod
-    def get_all_news_after_strtime(self, dt: datetime):
+    def get_news_by_ids(self, ids: list[int]) -> list[News]:
         pass
 
+    def start_cursor(self, from_time: str, until: str = '') -> PageCursor:
+        """Returns the cursor of the first page of news published after from_time and up to until,
+        up to the latest entry if until is empty."""
+
+        after_date = self._window_start(from_time).strftime('%Y-%m-%d %H:%M:%S')
+        return PageCursor(until=until or self.get_latest_entry_time(), after_date=after_date, after_id=MAX_ID)
+
+    def get_news_page(self, cursor: PageCursor, limit: int) -> list[News]:
+        """Returns up to limit news after the cursor, ordered by publish date and id.
+        Reads the whole window, the storages which can seek to the cursor should override it."""
+
+        strtime = (self._dt_from_pd(cursor.after_date) - timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S')
+        after = (cursor.after_date, cursor.after_id)
+        news = sorted(
+            (n for n in self.get_all_news_after_strtime(strtime)
+             if (n.publish_date, n.id) > after and n.publish_date <= cursor.until),
+            key=lambda n: (n.publish_date, n.id)
+        )
+        return news[:limit]
+
+    def get_latest_entry_time(self, format: str = '') -> datetime | str:
+        """Returns the latest news update time in either datetime or str."""
+
+        latest_entry = self._read_latest_entry()
+        if latest_entry is None:
+            publish_date = self._get_dt_from_the_past(
+                self._config.latest_update_time_from_now_if_no_file_exists
+            )
+        else:
+            publish_date = self._dt_from_pd(latest_entry)
+        new_publish_date = publish_date + timedelta(
+            seconds=self._config.time_delta_seconds_to_avoid_collisions
+        )
+        if format == 'datetime':
+            return new_publish_date
+        return new_publish_date.strftime("%Y-%m-%d %H:%M:%S")
+
+    def _read_latest_entry(self) -> str | None:
+        """Reads the latest news time stamp, returns None if nothing has been saved yet."""
+
+        if not os.path.exists(self._config.latest_update_filename):
+            return None
+        with open(self._config.latest_update_filename, 'r') as file:
+            return json.load(file)['latest_entry']
+
+    def _save_latest_entry(self, latest_news_date) -> None:
+        """Stores the latest news time stamp, it is used as a starting point for the next update.
+        The news are saved page by page in any order, so the time stamp only moves forward."""
+
+        latest_entry = self._read_latest_entry()
+        if latest_entry is not None and latest_entry >= str(latest_news_date):
+            return
+        with open(self._config.latest_update_filename, 'w') as file:
+            json.dump({'latest_entry': latest_news_date}, file, default=str)
+
+    def _window_start(self, strtime: str) -> datetime:
+        """Returns the time to fetch the news from.
+        If the user has not read any news yet, goes back a configured amount of hours."""
+
+        if not strtime:
+            return self.get_latest_entry_time(format='datetime') - timedelta(
+                hours=self._config.hours_of_news_to_return_if_user_has_no_news_read_yet
+            )
+        return self._dt_from_pd(strtime)
+
+    def _cut_off_date(self, news_expiration_hours: timedelta) -> datetime:
+        """Returns the naive UTC datetime before which the news are considered outdated."""
+
+        cut_off_date_utc = datetime.now(UTC) - news_expiration_hours
+        return cut_off_date_utc.replace(tzinfo=None)
+
+    def _get_dt_from_the_past(self, hours_before) -> datetime:
+        """Returns datetime from the past to the current time in UTC"""
+
+        offset = datetime.now(UTC) - timedelta(hours=hours_before)
+        return offset.replace(tzinfo=None)
+
+    def _dt_from_pd(self, pd: str) -> datetime:
+        """Converts time from a string as stored in publish_date to datetime."""
+
+        return datetime.strptime(pd, "%Y-%m-%d %H:%M:%S")
+
+    def _epoch_from_dt(self, dt: datetime) -> int:
+        """Converts a naive UTC datetime to epoch seconds."""
+
+        return timegm(dt.timetuple())
+
 
 class FileStorage(Storage):
+    """Keeps all the news in a single human-readable JSON file.
+    Next to it lies a binary index of publish times in epoch seconds, sorted just like the news,
+    which allows to find the news after a given time with a bisect.
+    The parsed and validated news and the latest entry time are cached in memory,
+    the cache is dropped on every write or when the files change on the disk."""
+
+    rewrites_on_save = True
+
     def __init__(self, storage_config: StorageConfig):
-        self._config = storage_config
+        super().__init__(storage_config)
+        self._lock = threading.Lock()
+        self._news_cache: CacheEntry | None = None
+        self._latest_entry_cache: CacheEntry | None = None
+        self._ids: set[int] | None = None
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def cache_stats(self) -> dict:
+        """Read cache hits and misses."""
+
+        return {'hits': self._hits, 'misses': self._misses}
 
     def delete_old_entries(self, news_expiration_hours: timedelta) -> None:
-        """Deletes the outdated entries given expiration hours and knowing current time."""
+        """Deletes the outdated entries given expiration hours and knowing current time.
+        The news are sorted, so the outdated ones are the head of the list found with a bisect."""
 
         logger.info('Deleting old entries')
-        cut_off_date_utc = datetime.now(UTC) - news_expiration_hours
-        cut_off_date = cut_off_date_utc.replace(tzinfo=None)
+        cut_off_date = self._cut_off_date(news_expiration_hours)
         logger.info(f'Purging news from {cut_off_date}')
         old_news = self._read_news_file()
-        filtered_entries = self._filter_entries(cut_off_date, old_news)
-        self._save_filtered_entries(filtered_entries)
-        logger.info(f'Purged {len(old_news) - len(filtered_entries)} old news')
+        index = self._read_time_index(old_news)
+        expired = bisect_right(index, self._epoch_from_dt(cut_off_date))
+        if expired:
+            self._write_news_file(old_news[expired:], index[expired:])
+            self._known_ids(old_news).difference_update(n['id'] for n in old_news[:expired])
+            self._invalidate_cache()
+        logger.info(f'Purged {expired} old news')
 
     def _read_news_file(self) -> list[dict]:
         """Reads the news file from the disk."""
@@ -55,96 +220,198 @@ class FileStorage(Storage):
             return []
         with open(self._config.news_filename, 'r') as file:
             data = json.load(file)
-        return data
+        return self._sorted_archive(data)
 
-    def _filter_entries(self, cut_off_date: datetime, news: list) -> list:
-        """Filters out the outdated entries given the cutoff date."""
+    def _sorted_archive(self, news: list[dict]) -> list[dict]:
+        """Returns the news sorted by publish date and id, the order the pages and the merges rely on.
+        The archives written before were sorted by publish date only, the news of the same second
+        in arrival order, so such an archive is sorted and written back with a new index."""
 
-        return [n for n in news if self._dt_from_pd(n['publish_date']) > cut_off_date]
+        keys = [(n['publish_date'], n['id']) for n in news]
+        if all(a <= b for a, b in zip(keys, keys[1:])):
+            return news
+        logger.warning('News file is not sorted by publish date and id, sorting it')
+        news = sorted(news, key=lambda n: (n['publish_date'], n['id']))
+        self._write_news_file(news, self._build_time_index(news))
+        return news
 
-    def _save_filtered_entries(self, filtered_entries) -> None:
-        """Saves the filtered entries to disk in an indented JSON."""
+    def _write_news_file(self, news: list[dict], index: array) -> None:
+        """Saves the news to disk in an indented JSON, and their time index next to them."""
 
-        with open(self._config.news_filename, 'w') as file:
-            json.dump(filtered_entries, file, indent=4, default=str)
+        tmp_filename = self._config.news_filename + '.tmp'
+        with open(tmp_filename, 'w') as file:
+            json.dump(news, file, indent=4, default=str)
             file.write('\n')
+        os.replace(tmp_filename, self._config.news_filename)
+        self._save_time_index(news, index)
 
-    def save_news(self, final_data, latest_news_date) -> None:
-        """The public function to save the news. """
+    def save_news(self, final_data, latest_news_date) -> IngestionReport:
+        """The public function to save the news.
+        The already stored news are rejected by id before the archive is read, so a batch of duplicates
+        does not touch the file once the ids are known. The rest are sorted and merged into the already
+        sorted archive, and their ids are known as stored only once the archive is written."""
 
         logger.info(f'Saving news files. {len(final_data)} new entries, {latest_news_date=}')
         if not final_data:
             logger.info('No new news, not messing with files')
-            return
+            return IngestionReport(new=0, duplicates=0)
+        news = None
+        if self._ids is None:
+            news = self._read_archive()
+        known_ids = self._known_ids(news)
+        batch = {}
+        for entry in final_data:
+            if entry['id'] not in known_ids:
+                batch.setdefault(entry['id'], entry)
+        report = IngestionReport(new=len(batch), duplicates=len(final_data) - len(batch), new_ids=list(batch))
+        if not batch:
+            self._save_latest_entry(latest_news_date)
+            logger.info(f'All {report.duplicates} news are already stored, the news file is left as it is')
+            return report
+        self._merge_into_archive(self._read_archive() if news is None else news, list(batch.values()))
+        known_ids.update(batch)
+        self._save_latest_entry(latest_news_date)
+        self._invalidate_cache()
+        logger.info(f'Files saved, {report.new} new news, {report.duplicates} duplicates')
+        return report
+
+    def _read_archive(self) -> list[dict]:
+        """Reads the news file for a write, a corrupted one is started anew."""
+
         try:
-            news = self._read_news_file()
+            return self._read_news_file()
         except json.decoder.JSONDecodeError:
-            news = []
-        else:
-            news.extend(final_data)
-            unique_news = self._filter_unique_by_id(news)
-            sorted_news = sorted(unique_news, key=lambda x: self._dt_from_pd(x['publish_date']))
-            with open(self._config.news_filename, 'w') as file:
-                json.dump(sorted_news, file, indent=4, default=str)
-                file.write('\n')
-        with open(self._config.latest_update_filename, 'w') as file:
-            json.dump({'latest_entry': latest_news_date}, file, default=str)
-        logger.info('Files saved')
+            logger.exception('News file is corrupted, starting a new one')
+            return []
 
-    def get_latest_entry_time(self, format: str = '') -> datetime | str:
-        """Returns the latest news update time in either datetime or str."""
+    def _merge_into_archive(self, news: list[dict], batch: list[dict]) -> None:
+        """Sorts the new news and merges them with the sorted archive, merging the time index along."""
 
-        if not os.path.exists(self._config.latest_update_filename):
-            publish_date = self._get_dt_from_the_past(
-                self._config.latest_update_time_from_now_if_no_file_exists
-            )
-        else:
-            with open(self._config.latest_update_filename, 'r') as file:
-                result = json.load(file)
-            publish_date = self._dt_from_pd(result['latest_entry'])
-        new_publish_date = publish_date + timedelta(
-            seconds=self._config.time_delta_seconds_to_avoid_collisions
-        )
-        if format == 'datetime':
-            return new_publish_date
-        return new_publish_date.strftime("%Y-%m-%d %H:%M:%S")
+        batch_keys = [(self._epoch_from_dt(self._dt_from_pd(n['publish_date'])), n['id']) for n in batch]
+        new_rows = sorted(zip(batch_keys, batch), key=itemgetter(0))
+        old_rows = (((epoch, n['id']), n) for epoch, n in zip(self._read_time_index(news), news))
+        merged_news, merged_index = [], array('q')
+        for (epoch, _), entry in merge(old_rows, new_rows, key=itemgetter(0)):
+            merged_news.append(entry)
+            merged_index.append(epoch)
+        self._write_news_file(merged_news, merged_index)
 
-    def _filter_unique_by_id(self, news_list: list) -> list:
-        """Filters the news by unique id."""
+    def _known_ids(self, news: list[dict] | None) -> set[int]:
+        """Returns the ids of the stored news.
+        The set is built from the archive once and then kept up to date on every write."""
 
-        seen_ids = set()
-        return [
-            news for news in news_list if news['id'] not in seen_ids and not seen_ids.add(news["id"])
-        ]
+        if self._ids is None:
+            self._ids = {n['id'] for n in news}
+        return self._ids
 
-    def _get_dt_from_the_past(self, hours_before) -> datetime:
-        """Returns datetime from the past to the current time in UTC"""
+    def get_latest_entry_time(self, format: str = '') -> datetime | str:
+        """Returns the latest news update time, reading the file only if it has changed."""
 
-        offset = datetime.now(UTC) - timedelta(hours=hours_before)
-        return offset.replace(tzinfo=None)
+        stamp = self._file_stamp(self._config.latest_update_filename)
+        with self._lock:
+            if self._cache_is_fresh(self._latest_entry_cache, stamp):
+                latest = self._latest_entry_cache.value
+            else:
+                latest = super().get_latest_entry_time(format='datetime')
+                if stamp:
+                    self._latest_entry_cache = CacheEntry(stamp, latest)
+        if format == 'datetime':
+            return latest
+        return latest.strftime("%Y-%m-%d %H:%M:%S")
 
-    def get_all_news_after_strtime(self, strtime: str):
+    def get_all_news_after_strtime(self, strtime: str) -> list[News]:
         """Public method to get all new news from a specific time in str."""
 
-        if not strtime:
-            dt = self.get_latest_entry_time(format='datetime') - timedelta(
-                hours=self._config.hours_of_news_to_return_if_user_has_no_news_read_yet
-            )
-        else:
-            dt = self._dt_from_pd(strtime)
+        dt = self._window_start(strtime)
         logger.info(f'Fetching all news from {dt}')
-        data = self._read_news_file()
-        found_first_entry = False
-        i = 0
-        while not found_first_entry and i < len(data):
-            if self._dt_from_pd(data[i]['publish_date']) <= dt:
-                i += 1
-                continue
-            found_first_entry = True
-        logger.info(f'Returning {len(data) - i} out of {len(data)} entries.')
-        return data[i:]
+        news, index, _ = self._cached_news()
+        i = bisect_right(index, self._epoch_from_dt(dt))
+        logger.info(f'Returning {len(news) - i} out of {len(news)} entries. Cache: {self.cache_stats}')
+        return news[i:]
 
-    def _dt_from_pd(self, pd: str) -> datetime:
-        """Converts time from a string as stored in publish_date to datetime."""
+    def get_news_page(self, cursor: PageCursor, limit: int) -> list[News]:
+        """Returns up to limit news after the cursor, the page start is bisected in the time index."""
 
-        return datetime.strptime(pd, "%Y-%m-%d %H:%M:%S")
+        news, index, _ = self._cached_news()
+        i = bisect_left(index, self._epoch_from_dt(self._dt_from_pd(cursor.after_date)))
+        after = (cursor.after_date, cursor.after_id)
+        while i < len(news) and (news[i].publish_date, news[i].id) <= after:
+            i += 1
+        page = []
+        for entry in news[i:i + limit]:
+            if entry.publish_date > cursor.until:
+                break
+            page.append(entry)
+        return page
+
+    def get_news_by_ids(self, ids: list[int]) -> list[News]:
+        """Returns the stored news with given ids in the order of the ids, unknown ids are skipped."""
+
+        *_, by_id = self._cached_news()
+        return [by_id[id_] for id_ in ids if id_ in by_id]
+
+    def _cached_news(self) -> tuple[list[News], array, dict[int, News]]:
+        """Returns the validated news, their time index and the news by id,
+        from the cache if the news file has not changed."""
+
+        with self._lock:
+            stamp = self._file_stamp(self._config.news_filename)
+            if stamp and self._cache_is_fresh(self._news_cache, stamp):
+                return self._news_cache.value
+            data = self._read_news_file()
+            news = [News.model_validate(n) for n in data]
+            value = (news, self._read_time_index(data), {n.id: n for n in news})
+            self._news_cache = CacheEntry(stamp or self._file_stamp(self._config.news_filename), value)
+            return value
+
+    def _cache_is_fresh(self, entry: CacheEntry | None, stamp: tuple[int, int] | None) -> bool:
+        """Checks if the cached entry was read from the file in its current state and counts hits and misses."""
+
+        if entry is not None and entry.stamp == stamp:
+            self._hits += 1
+            return True
+        self._misses += 1
+        return False
+
+    def _file_stamp(self, filename: str) -> tuple[int, int] | None:
+        """Returns the file modification time and size, or None if there's no file."""
+
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _invalidate_cache(self) -> None:
+        """Drops the cache after the files have been written."""
+
+        with self._lock:
+            self._news_cache = None
+            self._latest_entry_cache = None
+
+    def _build_time_index(self, news: list[dict]) -> array:
+        """Creates the index of publish times in epoch seconds."""
+
+        return array('q', (self._epoch_from_dt(self._dt_from_pd(n['publish_date'])) for n in news))
+
+    def _save_time_index(self, news: list[dict], index: array | None = None) -> array:
+        """Saves the index next to the news file, building it if it is not provided."""
+
+        if index is None:
+            index = self._build_time_index(news)
+        with open(self._config.news_index_filename, 'wb') as file:
+            index.tofile(file)
+        return index
+
+    def _read_time_index(self, news: list[dict]) -> array:
+        """Reads the index from the disk.
+        If it is missing or does not match the news file, rebuilds it."""
+
+        index = array('q')
+        if os.path.exists(self._config.news_index_filename):
+            with open(self._config.news_index_filename, 'rb') as file:
+                index.frombytes(file.read())
+        if len(index) != len(news):
+            logger.warning('News time index is missing or outdated, rebuilding')
+            index = self._save_time_index(news)
+        return index
@@ -0,0 +1,237 @@
+"""A local stand-in for the WorldNews API search, to run the news updater offline.
+
+Serves /search-news from a fixtures file or from synthetic news, with the API pagination,
+`available` counts, quota headers, latency and rate-limit errors. Point the updater to it with
+ParsingConfig.api_host.
+
+    python worldnews_stub.py --port 8090 --latency 0.1 --available 500
+    python worldnews_stub.py --port 8090 --fixtures fixtures.json
+    python worldnews_stub.py record --tags 'tesla, nvidia' --out fixtures.json
+
+Recording searches the real API with the WORLD_NEWS_API_KEY environment variable and costs quota.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import UTC, datetime, timedelta
+from hashlib import blake2b
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlparse
+
+import worldnewsapi
+
+logger = logging.getLogger(__name__)
+
+WORDS = (
+    'market company government report people city world technology game election energy court player '
+    'season police research president system price team million deal state border health space car '
+    'chip model network school climate water bank film music study security launch product vote'
+).split()
+
+
+class StubSettings(NamedTuple):
+    latency: float = 0.0  # seconds to wait before every response
+    available: int = 500  # synthetic news per query
+    news_per_hour: int = 20  # how densely the synthetic news are spread back in time
+    requests_per_second: float = 0  # answer 429 above this rate, 0 for no limit
+    error_rate: float = 0.0  # share of requests answered with 429 at random
+    daily_points: float = 0  # answer 402 when spent, 0 for no quota
+    fixtures: str = ''  # JSON list of recorded news, served instead of the synthetic ones
+
+
+class SearchStub:
+    """The state of the stand-in: the news it serves, the points spent and the request times."""
+
+    def __init__(self, settings: StubSettings) -> None:
+        self.settings = settings
+        self.started = datetime.now(UTC).replace(microsecond=0, tzinfo=None)
+        self.requests = 0
+        self.points_used = 0.0
+        self._fixtures = self._load_fixtures(settings.fixtures)
+        self._synthetic: dict[str, list[dict]] = {}
+        self._request_times: list[float] = []
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+
+    def search(self, query: dict[str, str]) -> tuple[int, dict, dict[str, str]]:
+        """Returns the status, the body and the headers of a search response."""
+
+        with self._lock:
+            self.requests += 1
+            if self._rate_limited():
+                return HTTPStatus.TOO_MANY_REQUESTS, {'message': 'Too many requests'}, {}
+            if self.settings.daily_points and self.points_used >= self.settings.daily_points:
+                return HTTPStatus.PAYMENT_REQUIRED, {'message': 'Daily quota used up'}, {}
+        offset, number = int(query.get('offset', 0)), int(query.get('number', 10))
+        news = self._matching_news(
+            query.get('text', ''), query.get('earliest-publish-date', ''), query.get('latest-publish-date', '')
+        )
+        page = news[offset:offset + number]
+        cost = 1 + 0.01 * len(page)
+        with self._lock:
+            self.points_used += cost
+            headers = {'X-API-Quota-Request': f'{cost:.2f}', 'X-API-Quota-Used': f'{self.points_used:.2f}'}
+            if self.settings.daily_points:
+                headers['X-API-Quota-Left'] = f'{max(0.0, self.settings.daily_points - self.points_used):.2f}'
+        return HTTPStatus.OK, {'offset': offset, 'number': number, 'available': len(news), 'news': page}, headers
+
+    def _rate_limited(self) -> bool:
+        if self.settings.error_rate and self._random.random() < self.settings.error_rate:
+            return True
+        if not self.settings.requests_per_second:
+            return False
+        now = time.monotonic()
+        self._request_times = [t for t in self._request_times if now - t < 1]
+        if len(self._request_times) >= self.settings.requests_per_second:
+            return True
+        self._request_times.append(now)
+        return False
+
+    def _matching_news(self, text: str, earliest: str, latest: str) -> list[dict]:
+        """Returns the news matching the query, newest first, as the updater asks for."""
+
+        tags = [tag.strip().lower() for tag in text.split(' OR ') if tag.strip()]
+        if self._fixtures is not None:
+            news = [
+                n for n in self._fixtures
+                if not tags or any(tag in f"{n.get('title', '')} {n.get('text', '')}".lower() for tag in tags)
+            ]
+        else:
+            with self._lock:
+                for tag in tags:
+                    if tag not in self._synthetic:
+                        self._synthetic[tag] = self._synthetic_news(tag)
+            news = [n for tag in tags for n in self._synthetic[tag]]
+        news = [n for n in news if n['publish_date'] >= earliest and (not latest or n['publish_date'] <= latest)]
+        return sorted(news, key=lambda n: (n['publish_date'], n['id']), reverse=True)
+
+    def _synthetic_news(self, tag: str) -> list[dict]:
+        """Creates the same news for the tag on every request, their publish dates are fixed at the start."""
+
+        seed = int.from_bytes(blake2b(tag.encode(), digest_size=4).digest(), 'big')
+        rng = random.Random(seed)
+        step = timedelta(hours=1) / self.settings.news_per_hour
+        news = []
+        for i in range(self.settings.available):
+            id_ = seed * 100_000 + i
+            text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(80, 300)))
+            news.append({
+                'id': id_,
+                'title': f'{tag.title()}: {" ".join(rng.sample(WORDS, 6))}',
+                'url': f'https://news.example.com/{tag.replace(" ", "-")}/{id_}',
+                'text': f'{tag} {text}',
+                'summary': ' '.join(rng.sample(WORDS, 12)),
+                'publish_date': (self.started - step * i).strftime('%Y-%m-%d %H:%M:%S'),
+                'language': 'en',
+                'source_country': 'us'
+            })
+        return news
+
+    def _load_fixtures(self, filename: str) -> list[dict] | None:
+        if not filename:
+            return None
+        with open(filename, 'r') as file:
+            return json.load(file)
+
+
+def make_handler(stub: SearchStub) -> type[BaseHTTPRequestHandler]:
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/search-news':
+                self._respond(HTTPStatus.NOT_FOUND, {'message': f'{url.path} is not stubbed'}, {})
+                return
+            time.sleep(stub.settings.latency)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self._respond(*stub.search(query))
+
+        def _respond(self, status: int, body: dict, headers: dict[str, str]) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return StubHandler
+
+
+def start_stub(settings: StubSettings, port: int = 0) -> tuple[ThreadingHTTPServer, SearchStub, str]:
+    """Starts the stand-in in a background thread, returns the server, its state and the API host to use."""
+
+    stub = SearchStub(settings)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(stub))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stub, f'http://127.0.0.1:{server.server_port}'
+
+
+def record(tags: str, out: str, pages: int) -> None:
+    """Saves the real API search results for the tags to a fixtures file."""
+
+    key = os.environ['WORLD_NEWS_API_KEY']
+    api_config = worldnewsapi.Configuration(host='https://api.worldnewsapi.com')
+    api_config.api_key['apiKey'] = key
+    api_config.api_key['headerApiKey'] = key
+    news = {}
+    with worldnewsapi.ApiClient(api_config) as api_client:
+        api = worldnewsapi.NewsApi(api_client)
+        for tag in (tag.strip() for tag in tags.split(',')):
+            for page in range(pages):
+                response = api.search_news(text=tag, language='en', number=100, offset=page * 100)
+                news.update({n.id: n.to_dict() for n in response.news or []})
+                if not response.news or (page + 1) * 100 >= response.available:
+                    break
+    with open(out, 'w') as file:
+        json.dump(list(news.values()), file, indent=4)
+    logger.info(f'Recorded {len(news)} news to {out}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    recorder = subparsers.add_parser('record', help='record fixtures from the real API')
+    recorder.add_argument('--tags', required=True)
+    recorder.add_argument('--out', default='fixtures.json')
+    recorder.add_argument('--pages', type=int, default=1, help='pages of 100 news per tag')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--available', type=int, default=500)
+    parser.add_argument('--news-per-hour', type=int, default=20)
+    parser.add_argument('--requests-per-second', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--daily-points', type=float, default=0)
+    parser.add_argument('--fixtures', default='')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.command == 'record':
+        record(args.tags, args.out, args.pages)
+        return
+    settings = StubSettings(
+        latency=args.latency, available=args.available, news_per_hour=args.news_per_hour,
+        requests_per_second=args.requests_per_second, error_rate=args.error_rate,
+        daily_points=args.daily_points, fixtures=args.fixtures
+    )
+    server, _, host = start_stub(settings, args.port)
+    logger.info(f'WorldNews API stand-in is serving at {host}, press Ctrl+C to stop')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
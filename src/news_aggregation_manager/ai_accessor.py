@@ -1,9 +1,11 @@
+import json
 import logging
 
-from config import ServiceConfig
+from config import DigestConfig, ServiceConfig
 from invokers import publish_message, publish_message_sync
+from metrics import MessageSizeMetrics
 from schema import (CreateDigestAIRequest, GenerateTagsRequest,
-                    NewNewsResponse, UserResponse)
+                    NewNewsRequest, NewNewsResponse, UserResponse)
 
 logger = logging.getLogger(__name__)
 
@@ -11,8 +13,10 @@ logger = logging.getLogger(__name__)
 class AI_Accessor:
     """Provides async interface to work with the ai_accessor."""
 
-    def __init__(self, config: ServiceConfig):
+    def __init__(self, config: ServiceConfig, digest_config: DigestConfig):
         self._config = config
+        self._digest_config = digest_config
+        self.message_sizes = MessageSizeMetrics()
 
     async def generate_tags(self, id_: int, desc: str, max_tags: int):
         """Publishes a message to ai_accessor to generate the tags."""
@@ -23,8 +27,20 @@ class AI_Accessor:
         logger.info(f'Message sent to queue: {request}')
 
     def create_digest(self, user: UserResponse, news: NewNewsResponse, id_: int):
-        """Publishes a request to create digest."""
+        """Publishes a request to create digest.
+        If the news make the message too big, or were not all fetched for being too big, sends the news window
+        instead, for the ai_accessor to fetch the news from the news_accessor itself."""
 
         logger.info('Placing task to create news digest')
-        request = CreateDigestAIRequest(user=user, news=news, id=id_)
-        return publish_message_sync(self._config.pubsub, self._config.topic, request.model_dump())
+        data = CreateDigestAIRequest(user=user, news=news, id=id_).model_dump()
+        size, mode = len(json.dumps(data).encode()), 'inline'
+        if news.next_cursor or size > self._digest_config.max_inline_message_bytes:
+            news_ref = NewNewsRequest(
+                from_time=user.latest_news_processed,
+                until=news.last_news_time,
+                fields=self._digest_config.headline_fields
+            )
+            data = CreateDigestAIRequest(user=user, news_ref=news_ref, id=id_).model_dump()
+            size, mode = len(json.dumps(data).encode()), 'reference'
+        self.message_sizes.record(mode, size)
+        return publish_message_sync(self._config.pubsub, self._config.topic, data)
@@ -24,7 +24,13 @@ class GRPCConfig:
 
 @dataclass
 class NewsConfig:
-    pause_between_updates_minutes: int
+    pause_between_updates_minutes: int  # news_accessor polls every tags bunch on its own schedule, not shorter
+
+
+@dataclass
+class DigestConfig:
+    headline_fields: list[str]  # news fields the AI needs to pick the news, full texts are fetched later
+    max_inline_message_bytes: int  # bigger digest requests carry a reference to the news instead of the news
 
 
 @dataclass
@@ -32,6 +38,7 @@ class Config:
     logging: LoggingConfig
     grpc: GRPCConfig
     news: NewsConfig
+    digest: DigestConfig
     service_name: str
 
 
@@ -45,7 +52,11 @@ def load_config():
             port=50055,
             tg=ServiceConfig(app_id='tg_accessor', pubsub='pubsub', topic='digest_report')
         ),
-        news=NewsConfig(pause_between_updates_minutes=60),
+        news=NewsConfig(pause_between_updates_minutes=15),
+        digest=DigestConfig(
+            headline_fields=['id', 'title', 'summary', 'url', 'publish_date'],
+            max_inline_message_bytes=256 * 1024
+        ),
         service_name='news_aggregation_manager'
     )
 
@@ -23,10 +23,11 @@ logging.config.dictConfig(config.logging.settings)
 logger = logging.getLogger(__name__)
 accountant = IDAccountant()
 news_accessor: News_Accessor = News_Accessor(config=config.grpc)
-ai_accessor: AI_Accessor = AI_Accessor(config=config.grpc.ai)
+ai_accessor: AI_Accessor = AI_Accessor(config=config.grpc.ai, digest_config=config.digest)
 db_accessor: DB_Accessor = DB_Accessor(db_app_id=config.grpc.db_accessor_app_id)
 processor: MessageProcessor = MessageProcessor(
-    ai=ai_accessor, db=db_accessor, news=news_accessor, id_acc=accountant, report_config=config.grpc.tg
+    ai=ai_accessor, db=db_accessor, news=news_accessor, id_acc=accountant, report_config=config.grpc.tg,
+    digest_config=config.digest
 )
 
 app = App()
@@ -53,6 +54,13 @@ def consumer(event: v1.Event) -> None:
         logger.error(f'Error processing message: {e}')
 
 
+@app.method('message_sizes')
+def message_sizes(request: InvokeMethodRequest) -> InvokeMethodResponse:
+    """Returns the sizes of the digest requests sent to the ai_accessor."""
+
+    return InvokeMethodResponse(data=json.dumps(ai_accessor.message_sizes.summary()))
+
+
 @app.method('ping')
 def ping_service(request: InvokeMethodRequest) -> InvokeMethodResponse:
     """Returns pong when pinged."""
@@ -62,12 +70,19 @@ def ping_service(request: InvokeMethodRequest) -> InvokeMethodResponse:
 
 
 async def news_updater(pause_minutes: int) -> None:
-    """Issues a news update request message on startup and then every pause_minutes minutes."""
+    """Issues a news update request message on startup and then every pause_minutes minutes.
+    If the news API budget spread over the day does not cover an update yet, the update is deferred."""
 
     logger.info(f'Starting news updater, updates are scheduled every {pause_minutes} minutes')
     while True:
-        logger.info('Issuing an order to update news!')
         try:
+            quota = await news_accessor.get_quota()
+            if quota and quota.seconds_until_affordable:
+                defer_seconds = min(quota.seconds_until_affordable, pause_minutes * 60)
+                logger.info(f'News API budget is ahead of schedule ({quota}), deferring update for {defer_seconds}s')
+                await asyncio.sleep(defer_seconds)
+                continue
+            logger.info('Issuing an order to update news!')
             await news_accessor.update_news()
             await asyncio.sleep(pause_minutes * 60)
         except Exception as e:
@@ -0,0 +1,25 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MessageSizeMetrics:
+    """Counts the messages and their sizes in bytes by mode, e.g. inline or reference."""
+
+    def __init__(self) -> None:
+        self._stats: dict[str, dict] = {}
+
+    def record(self, mode: str, size: int) -> None:
+        stats = self._stats.setdefault(mode, {'messages': 0, 'total_bytes': 0, 'max_bytes': 0})
+        stats['messages'] += 1
+        stats['total_bytes'] += size
+        stats['max_bytes'] = max(stats['max_bytes'], size)
+        logger.info(f'Message size: {size} bytes, sent {mode}. Totals: {self.summary()}')
+
+    def summary(self) -> dict[str, dict]:
+        """Returns the stats by mode with the average message size."""
+
+        return {
+            mode: {**stats, 'avg_bytes': stats['total_bytes'] // stats['messages']}
+            for mode, stats in self._stats.items()
+        }
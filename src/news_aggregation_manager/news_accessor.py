@@ -1,9 +1,13 @@
 import json
 import logging
+from typing import Iterator
+
+from pydantic import ValidationError
 
 from config import GRPCConfig
 from invokers import invoke_method, invoke_method_sync, publish_message
-from schema import NewNewsResponse, Tags, UpdateNewsRequest
+from schema import (NewNewsRequest, NewNewsResponse, QuotaResponse, Tags,
+                    UpdateNewsRequest)
 
 logger = logging.getLogger(__name__)
 
@@ -23,12 +27,49 @@ class News_Accessor:
         data = UpdateNewsRequest(detail=Tags(tags=all_tags))
         await publish_message(self._config.news.pubsub, self._config.news.topic, data.model_dump())
 
-    def get_new_news(self, update_from: str) -> list:
-        """Fetches new news after specific time."""
+    async def get_quota(self) -> QuotaResponse | None:
+        """Fetches the news API quota status, returns None if it is unavailable."""
+
+        response = await invoke_method(self._config.news.app_id, 'get_quota', '')
+        try:
+            return QuotaResponse.model_validate_json(response)
+        except ValidationError:
+            logger.warning(f'Could not get the news API quota: {response}')
+            return None
+
+    def get_new_news(
+            self, update_from: str, fields: list[str] | None = None, max_bytes: int | None = None) -> NewNewsResponse:
+        """Fetches all new news after specific time, only the given fields if provided.
+        With max_bytes the pages stop being fetched as soon as the news take more, then the response
+        keeps the next_cursor, as the sign that the news of the window are not all there."""
 
         logger.info('Getting new news')
-        news = NewNewsResponse.model_validate(
-            json.loads(invoke_method_sync(self._config.news.app_id, 'get_new_news', update_from))
-        )
+        news = NewNewsResponse(last_news_time='', news=[])
+        size = 0
+        for page in self.iter_new_news_pages(update_from, fields):
+            news.last_news_time = news.last_news_time or page.last_news_time
+            news.news.extend(page.news)
+            news.next_cursor = page.next_cursor
+            size += len(page.model_dump_json().encode())
+            if max_bytes is not None and size > max_bytes and news.next_cursor:
+                logger.info(f'Stopped fetching after {len(news.news)} news, they take over {max_bytes} bytes')
+                return news
+        news.next_cursor = ''
         logger.info(f'Fetched {len(news.news)} news.')
         return news
+
+    def iter_new_news_pages(self, update_from: str, fields: list[str] | None = None) -> Iterator[NewNewsResponse]:
+        """Yields the pages of new news after specific time one by one, following the cursors."""
+
+        request = NewNewsRequest(from_time=update_from, fields=fields)
+        while True:
+            page = NewNewsResponse.model_validate(
+                json.loads(invoke_method_sync(self._config.news.app_id, 'get_new_news', request.model_dump_json()))
+            )
+            yield page
+            if not page.next_cursor:
+                return
+            if page.next_cursor == request.cursor:
+                logger.error(f'The news_accessor returned the same cursor again, stopping: {page.next_cursor}')
+                return
+            request = NewNewsRequest(cursor=page.next_cursor, fields=fields)
@@ -1,7 +1,7 @@
 import logging
 
 from ai_accessor import AI_Accessor
-from config import ServiceConfig
+from config import DigestConfig, ServiceConfig
 from db_accessor import DB_Accessor
 from id_accountant import IDAccountant
 from invokers import publish_message_sync
@@ -17,11 +17,13 @@ class MessageProcessor:
     Can store logic for other complex actions as well."""
 
     def __init__(
-        self, ai: AI_Accessor, db: DB_Accessor, news: News_Accessor, id_acc: IDAccountant, report_config: ServiceConfig
+        self, ai: AI_Accessor, db: DB_Accessor, news: News_Accessor, id_acc: IDAccountant,
+        report_config: ServiceConfig, digest_config: DigestConfig
     ) -> None:
         self._ai = ai
         self._db = db
         self._news = news
+        self._digest_config = digest_config
         self._request_attributes = id_acc
         self._reporter = report_config
 
@@ -35,9 +37,11 @@ class MessageProcessor:
             return
         logger.info('User fetched, proceeding with digest creation')
         all_new_news: NewNewsResponse = self._news.get_new_news(
-            user.latest_news_processed
+            user.latest_news_processed,
+            fields=self._digest_config.headline_fields,
+            max_bytes=self._digest_config.max_inline_message_bytes
         )
-        logger.info('Fetched all new news. Generating digest.')
+        logger.info('Fetched new news headlines. Generating digest.')
         result = self._ai.create_digest(
             user,
             all_new_news,
@@ -14,6 +14,16 @@ class UpdateNewsRequest(Message):
     detail: Tags
 
 
+class QuotaResponse(BaseModel):
+    budget: float
+    used: float
+    left: float
+    allowance: float
+    average_cycle_cost: float
+    forecast: float
+    seconds_until_affordable: int
+
+
 class GenerateTagsRequest(Message):
     subject: str = 'generate_tags'
     id: int
@@ -51,19 +61,28 @@ class News(BaseModel):
     title: str
     url: str
     id: int
-    text: str
+    text: str | None = None  # not fetched for the headlines
     publish_date: str
 
 
+class NewNewsRequest(BaseModel):
+    from_time: str = ''
+    until: str = ''  # the end of the window, the latest news if empty
+    fields: list[str] | None = None
+    cursor: str = ''
+
+
 class NewNewsResponse(BaseModel):
     last_news_time: str
     news: list[News]
+    next_cursor: str = ''
 
 
 class CreateDigestAIRequest(Message):
     subject: str = 'create_digest_ai_request'
     user: UserResponse
-    news: NewNewsResponse
+    news: NewNewsResponse | None = None
+    news_ref: NewNewsRequest | None = None  # sent instead of the news when they are too big for a message
     id: int
 
 
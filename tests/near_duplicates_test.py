@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'news_accessor'))
+
+from near_duplicates import NearDuplicateDetector  # noqa: E402
+
+STORY = 'The central bank raised interest rates by half a point on Tuesday, citing persistent inflation. ' * 3
+
+
+def news(id_, url, publish_date):
+    return {'id': id_, 'title': 'Rates are up', 'text': STORY, 'url': url, 'publish_date': publish_date}
+
+
+@pytest.fixture
+def detector():
+    result = NearDuplicateDetector(max_distance=3)
+    result.seed([])
+    return result
+
+
+def test_Given_copies_in_one_batch_When_collapsing_Then_the_earliest_is_kept_with_the_other_urls(detector):
+    collapsed = detector.collapse([
+        news(2, 'https://b.com/rates', '2024-08-01 10:05:00'),
+        news(1, 'https://a.com/rates', '2024-08-01 10:00:00')
+    ])
+    assert [n['id'] for n in collapsed] == [1]
+    assert collapsed[0]['duplicate_urls'] == ['https://b.com/rates']
+
+
+def test_Given_a_stored_news_When_its_copy_comes_in_a_later_batch_Then_the_copy_is_dropped_without_its_url(detector):
+    stored = detector.collapse([news(1, 'https://a.com/rates', '2024-08-01 10:00:00')])
+    detector.commit([n['id'] for n in stored])
+    copy = news(2, 'https://b.com/rates', '2024-08-01 11:00:00')
+    assert detector.collapse([copy]) == []
+    assert stored[0]['duplicate_urls'] == []
+    assert 'duplicate_urls' not in copy
+
+
+def test_Given_a_batch_not_saved_When_it_comes_again_Then_its_news_are_not_dropped(detector):
+    batch = [news(1, 'https://a.com/rates', '2024-08-01 10:00:00')]
+    detector.collapse([dict(n) for n in batch])
+    assert [n['id'] for n in detector.collapse([dict(n) for n in batch])] == [1]